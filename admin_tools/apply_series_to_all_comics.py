@@ -1,3 +1,4 @@
+import json
 import sqlite3
 
 connection = sqlite3.connect("../db/database.db")
@@ -18,6 +19,12 @@ else:
     )
 
 id = connection.execute("SELECT last_insert_rowid()").fetchone()[0]
-connection.execute("UPDATE comics SET seriesid = ?", (id,))
+# changing every comic at once would lock the database until it's done, so
+# the site does it in chunks in the background (see common/jobs.py)
+connection.execute(
+    "INSERT INTO jobs (kind, args) VALUES (?, ?)",
+    ("apply_series", json.dumps({"seriesid": id, "series": seriesname})),
+)
 connection.commit()
 connection.close()
+print("Queued; the site will put every comic in the series shortly.")
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common.images import make_renditions
+from common.storage import image_path
+
+load_dotenv("../.env")
+UPLOAD_FOLDER = "../static/comics"
+WIDTHS = tuple(
+    int(width) for width in os.getenv("RENDITION_WIDTHS", "240,480,960,1920").split(",")
+)
+FORMAT = os.getenv("RENDITION_FORMAT", "webp").lower()
+
+
+def render(comic: dict):
+    source = image_path(comic, folder=UPLOAD_FOLDER)
+    return make_renditions(source, source.rsplit(".", 1)[0], WIDTHS, FORMAT)
+
+
+if __name__ == "__main__":
+    connection = sqlite3.connect("../db/database.db")
+    connection.row_factory = sqlite3.Row
+    # comics that share an image share its renditions, so only make them once
+    comics = [
+        dict(comic)
+        for comic in connection.execute(
+            "SELECT min(id) AS id, fileext, filehash FROM comics"
+            " WHERE renditions IS NULL GROUP BY coalesce(filehash, id)"
+        ).fetchall()
+    ]
+    print(f"making renditions for {len(comics)} images")
+    done = 0
+    with ProcessPoolExecutor() as pool:
+        futures = {pool.submit(render, comic): comic for comic in comics}
+        for future in as_completed(futures):
+            comic = futures[future]
+            try:
+                width, made = future.result()
+            except Exception as e:
+                print(f"comic {comic['id']} failed: {e!r}")
+                continue
+            connection.execute(
+                "UPDATE comics SET (width, renditions) = (?, ?)"
+                " WHERE id = ? OR filehash = ?",
+                (width, ",".join(made), comic["id"], comic["filehash"]),
+            )
+            done += 1
+            # commit as we go, so an interrupted backfill can pick up where it left off
+            if done % 100 == 0:
+                connection.commit()
+                print(f"{done}/{len(comics)}")
+    connection.commit()
+    connection.close()
+    print(f"made renditions for {done} images")
@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+
+parser = argparse.ArgumentParser(
+    description="Add a zip file or folder of comics for an artist"
+)
+parser.add_argument("artist", help="username of the artist to add them for")
+parser.add_argument("source", help="zip file or folder with a manifest.csv")
+args = parser.parse_args()
+source = os.path.abspath(args.source)
+# the web app's paths are relative to the top of the repository
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.getcwd())
+
+from app import create_app
+from common.artist import Artist
+from common.bulk import import_comics
+from common.db import get_db_connection
+
+app = create_app()
+with app.test_request_context():
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT * FROM artists WHERE username = ?", (args.artist,)
+    ).fetchone()
+    if row is None:
+        print(f"there is no artist called {args.artist}")
+        sys.exit(1)
+    ids, problems = import_comics(conn, Artist(row), source)
+    conn.close()
+for problem in problems:
+    print(problem)
+if problems:
+    print("nothing was added")
+    sys.exit(1)
+print(f"added {len(ids)} comics, making their renditions")
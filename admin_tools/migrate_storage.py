@@ -0,0 +1,102 @@
+import os
+import shutil
+import sqlite3
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common.storage import hash_file, hashed_name, normal_fileext
+
+UPLOAD_FOLDER = "../static/comics"
+
+
+def link(old: str, new: str):
+    if os.path.exists(new):
+        # identical image, already moved for another comic
+        return
+    os.makedirs(os.path.dirname(new), exist_ok=True)
+    # comics with identical images are linked at the same time by different
+    # threads, so each needs its own temporary name
+    tmp = f"{new}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(old, tmp)
+    except OSError:
+        shutil.copy2(old, tmp)
+    os.replace(tmp, new)
+
+
+def migrate(comic: dict) -> tuple[str, str, list[str]]:
+    """Give a comic's files their new names, returning the hash, extension
+    and old paths.
+
+    The old files are only removed once the database points at the new
+    ones, so an interrupted migration can just be run again.
+    """
+    # hashing is mostly spent in hashlib and the disk, which don't hold the GIL
+    source = os.path.join(UPLOAD_FOLDER, f"{comic['id']}.{comic['fileext']}")
+    filehash = hash_file(source)
+    # the same image saved as .jpeg and .jpg must end up as one file
+    fileext = normal_fileext(comic["fileext"])
+    name = hashed_name(filehash, fileext)
+    link(source, os.path.join(UPLOAD_FOLDER, name))
+    old_paths = [source]
+    for rendition in (comic["renditions"] or "").split(","):
+        if rendition:
+            old = os.path.join(UPLOAD_FOLDER, f"{comic['id']}-{rendition}")
+            link(
+                old,
+                os.path.join(UPLOAD_FOLDER, f"{name.rsplit('.', 1)[0]}-{rendition}"),
+            )
+            old_paths.append(old)
+    return filehash, fileext, old_paths
+
+
+def remove(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == "__main__":
+    connection = sqlite3.connect("../db/database.db")
+    connection.row_factory = sqlite3.Row
+    version = connection.execute("SELECT * FROM pragma_user_version").fetchone()[0]
+    if version < 6:
+        print("Upgrade the database first! (python upgrade_db.py)")
+        exit()
+    comics = [
+        dict(comic)
+        for comic in connection.execute(
+            "SELECT id, fileext, renditions FROM comics WHERE filehash IS NULL"
+        ).fetchall()
+    ]
+    print(f"moving {len(comics)} images")
+    done = 0
+    moved = []
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        futures = {pool.submit(migrate, comic): comic for comic in comics}
+        for future in as_completed(futures):
+            comic = futures[future]
+            try:
+                filehash, fileext, old_paths = future.result()
+            except Exception as e:
+                print(f"comic {comic['id']} failed: {e!r}")
+                continue
+            connection.execute(
+                "UPDATE comics SET filehash = ?, fileext = ? WHERE id = ?",
+                (filehash, fileext, comic["id"]),
+            )
+            moved.extend(old_paths)
+            done += 1
+            if done % 100 == 0:
+                connection.commit()
+                remove(moved)
+                moved = []
+                print(f"{done}/{len(comics)}")
+    connection.commit()
+    remove(moved)
+    connection.close()
+    print(f"moved {done} images")
@@ -0,0 +1,318 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common.storage import hash_file, image_path
+
+# a whole site in one tar stream, for moving it to another machine or
+# restoring a backup:
+#
+#   manifest.json         the sha256 and size of everything below
+#   database.db           a consistent snapshot, safe to take while the site runs
+#   comics/...            every image and rendition the database refers to
+#   missing.json          anything removed while it was being exported
+#
+# python site_archive.py export site.tar   (or - to write to stdout)
+# python site_archive.py import site.tar   (or - to read from stdin)
+MANIFEST = "manifest.json"
+DATABASE = "database.db"
+MISSING = "missing.json"
+# files are copied out of the archive this much at a time
+CHUNK_SIZE = 1024 * 1024
+# bytes written out by the import that are still waiting to be checked,
+# which caps how far reading the archive gets ahead of the checking
+IMPORT_SPOOL = 256 * 1024 * 1024
+
+
+def report(message: str):
+    # stdout may be the archive
+    print(message, file=sys.stderr)
+
+
+def snapshot(database: str) -> str:
+    """Copy the database with the online backup api, returning the copy's path.
+
+    The site's database is in WAL mode, so it carries on writing while this
+    reads, and copying it in one step means the copy never has to restart.
+    """
+    fd, path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(database))
+    os.close(fd)
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(path)
+    source.backup(target)
+    target.close()
+    source.close()
+    return path
+
+
+def referenced_files(database: str, folder: str) -> dict[str, list[int]]:
+    """Map the name of every file the database uses to the comics using it."""
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    names = {}
+    for comic in conn.execute("SELECT id, fileext, filehash, renditions FROM comics"):
+        paths = [image_path(comic, folder=folder)]
+        for rendition in (comic["renditions"] or "").split(","):
+            if rendition:
+                paths.append(image_path(comic, rendition, folder))
+        for path in paths:
+            names.setdefault(os.path.relpath(path, folder), []).append(comic["id"])
+    conn.close()
+    return names
+
+
+def stored_files(folder: str) -> set[str]:
+    names = set()
+    for root, dirs, files in os.walk(folder):
+        if root == folder:
+            # uploads still in progress
+            dirs[:] = [d for d in dirs if d != "tmp"]
+        for name in files:
+            names.add(os.path.relpath(os.path.join(root, name), folder))
+    return names
+
+
+def entry(path: str) -> dict | None:
+    try:
+        return {"sha256": hash_file(path), "size": os.path.getsize(path)}
+    except FileNotFoundError:
+        # removed since it was listed, like a comic deleted meanwhile
+        return None
+
+
+def add_json(tar: tarfile.TarFile, name: str, value, mtime: float):
+    data = json.dumps(value, indent=1).encode()
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(mtime)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def export(args):
+    snapshot_path = snapshot(args.database)
+    try:
+        referenced = referenced_files(snapshot_path, args.comics)
+        stored = stored_files(args.comics)
+        names = sorted(set(referenced) & stored)
+        missing = sorted(set(referenced) - stored)
+        orphans = sorted(stored - set(referenced))
+        for name in missing:
+            report(f"missing: {name}, used by comics {referenced[name]}")
+        for name in orphans:
+            report(f"orphan: {name} isn't used by any comic, so isn't exported")
+
+        # hashing is mostly spent in hashlib and the disk, which don't hold the GIL
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            entries = pool.map(
+                entry, [os.path.join(args.comics, name) for name in names]
+            )
+            files = {}
+            for name, e in zip(names, entries):
+                if e is None:
+                    report(f"missing: {name} was removed while exporting")
+                    missing.append(name)
+                else:
+                    files[f"comics/{name}"] = e
+        names = [name for name in names if f"comics/{name}" in files]
+        files[DATABASE] = entry(snapshot_path)
+        manifest = {
+            "created": time.time(),
+            "files": files,
+            "missing": missing,
+            "orphans": orphans,
+        }
+
+        # the manifest has already been written by the time a file could
+        # vanish, so those are listed after everything else
+        vanished = []
+        out = sys.stdout.buffer if args.archive == "-" else open(args.archive, "wb")
+        with out, tarfile.open(fileobj=out, mode="w|") as tar:
+            add_json(tar, MANIFEST, manifest, manifest["created"])
+            tar.add(snapshot_path, DATABASE)
+            for name in names:
+                try:
+                    # once it's open it can't go away underneath us
+                    f = open(os.path.join(args.comics, name), "rb")
+                except FileNotFoundError:
+                    report(f"missing: {name} was removed while exporting")
+                    vanished.append(name)
+                    continue
+                with f:
+                    tar.addfile(tar.gettarinfo(arcname=f"comics/{name}", fileobj=f), f)
+            if vanished:
+                add_json(tar, MISSING, vanished, time.time())
+    finally:
+        os.remove(snapshot_path)
+    report(
+        f"exported the database and {len(names) - len(vanished)} files"
+        f" ({len(missing) + len(vanished)} missing, {len(orphans)} orphans)"
+    )
+
+
+class Spool:
+    """Counts the bytes written out but not checked yet, up to `limit`."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size: int):
+        with self.condition:
+            # a file bigger than the limit still goes through, on its own
+            self.condition.wait_for(
+                lambda: self.used == 0 or self.used + size <= self.limit
+            )
+            self.used += size
+
+    def release(self, size: int):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+def spool(source, path: str) -> str:
+    """Copy one file out of the archive to a temporary file next to `path`."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # unique, in case anything else is writing the same file
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            while chunk := source.read(CHUNK_SIZE):
+                f.write(chunk)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return tmp
+
+
+def restore(tmp: str, path: str, expected: dict) -> str | None:
+    """Put a spooled file in place, returning what was wrong with it."""
+    if hash_file(tmp) != expected["sha256"]:
+        os.remove(tmp)
+        return "its sha256 doesn't match the manifest"
+    os.replace(tmp, path)
+    return None
+
+
+def import_(args):
+    if os.path.exists(args.database) and not args.force:
+        report(f"{args.database} already exists, use --force to replace it")
+        sys.exit(1)
+    source = sys.stdin.buffer if args.archive == "-" else open(args.archive, "rb")
+    problems = []
+    received = set()
+    vanished = []
+    # the database is only put in place if everything checks out
+    database_tmp = f"{args.database}.{os.getpid()}.tmp"
+    spooled = Spool(IMPORT_SPOOL)
+    comics = os.path.realpath(args.comics)
+
+    def restore_file(tmp: str, path: str, name: str, expected: dict):
+        try:
+            problem = restore(tmp, path, expected)
+        except OSError as e:
+            problem = repr(e)
+        finally:
+            spooled.release(expected["size"])
+        if problem is not None:
+            problems.append(f"{name}: {problem}")
+
+    with source, tarfile.open(fileobj=source, mode="r|") as tar:
+        members = iter(tar)
+        first = next(members, None)
+        if first is None or first.name != MANIFEST:
+            report(f"that isn't a site archive, it doesn't start with {MANIFEST}")
+            sys.exit(1)
+        manifest = json.load(tar.extractfile(first))
+        files = manifest["files"]
+        # the tar has to be read in order, but each file is streamed to disk
+        # and then hashed and put in place alongside reading the next one
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            for member in members:
+                name = member.name
+                if name == MISSING and member.isfile():
+                    vanished = json.load(tar.extractfile(member))
+                    continue
+                if not member.isfile() or name not in files or name in received:
+                    problems.append(f"{name}: isn't in the manifest")
+                    continue
+                received.add(name)
+                if member.size != files[name]["size"]:
+                    problems.append(f"{name}: its size doesn't match the manifest")
+                    continue
+                if name == DATABASE:
+                    path = database_tmp
+                else:
+                    path = os.path.join(args.comics, name.removeprefix("comics/"))
+                    # nothing outside the comics folder
+                    if not os.path.realpath(path).startswith(comics + os.sep):
+                        problems.append(f"{name}: isn't in the comics folder")
+                        continue
+                spooled.acquire(member.size)
+                try:
+                    tmp = spool(tar.extractfile(member), path)
+                except OSError as e:
+                    spooled.release(member.size)
+                    problems.append(f"{name}: {e!r}")
+                    continue
+                pool.submit(restore_file, tmp, path, name, files[name])
+
+    # removed while it was exported, so they were never going to arrive
+    manifest["missing"] += vanished
+    vanished = {f"comics/{name}" for name in vanished}
+    for name in sorted(set(files) - received - vanished):
+        problems.append(f"{name}: is in the manifest but not the archive")
+    for name in manifest["missing"]:
+        report(f"missing: {name} was already missing when this was exported")
+    for problem in problems:
+        report(problem)
+    if problems:
+        if os.path.exists(database_tmp):
+            os.remove(database_tmp)
+        report("the archive didn't match its manifest, so the database wasn't restored")
+        sys.exit(1)
+
+    # the old database's write-ahead log would be applied to the new one
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(args.database + suffix):
+            os.remove(args.database + suffix)
+    os.replace(database_tmp, args.database)
+    # anything the database uses that still isn't there
+    referenced = referenced_files(args.database, args.comics)
+    missing = sorted(set(referenced) - stored_files(args.comics))
+    for name in missing:
+        if name not in manifest["missing"]:
+            report(f"missing: {name}, used by comics {referenced[name]}")
+    report(f"restored the database and {len(received) - 1} files")
+
+
+parser = argparse.ArgumentParser(description="Export or import a whole site")
+parser.add_argument("--database", default="../db/database.db")
+parser.add_argument("--comics", default="../static/comics")
+commands = parser.add_subparsers(required=True)
+export_parser = commands.add_parser("export", help="write the site to a tar stream")
+export_parser.add_argument("archive", help="file to write, or - for stdout")
+export_parser.set_defaults(command=export)
+import_parser = commands.add_parser("import", help="restore a site from a tar stream")
+import_parser.add_argument("archive", help="file to read, or - for stdin")
+import_parser.add_argument(
+    "--force", action="store_true", help="replace an existing database"
+)
+import_parser.set_defaults(command=import_)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.command(args)
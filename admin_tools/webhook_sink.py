@@ -0,0 +1,56 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# a stand-in for a discord webhook, for checking the outbox without spamming
+# a real channel. Point DISCORD_WEBHOOK_URL at http://localhost:PORT/ and
+# every message it receives is printed
+
+parser = argparse.ArgumentParser(description="Print webhook messages")
+parser.add_argument("--port", type=int, default=8099)
+parser.add_argument(
+    "--delay", type=float, default=0, help="seconds to wait before answering"
+)
+parser.add_argument(
+    "--fail", type=int, default=0, help="answer this many requests with a 500 first"
+)
+parser.add_argument(
+    "--ratelimit",
+    type=int,
+    default=0,
+    help="answer this many requests with a 429 first",
+)
+args = parser.parse_args()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(args.delay)
+        if args.ratelimit > 0:
+            args.ratelimit -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            print("429")
+            return
+        if args.fail > 0:
+            args.fail -= 1
+            self.send_response(500)
+            self.end_headers()
+            print("500")
+            return
+        message = json.loads(body)
+        print(f"{message['username']}: {len(message['embeds'])} embeds")
+        for embed in message["embeds"]:
+            print(f"  {embed['title']} {embed['url']}")
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+print(f"listening on port {args.port}")
+ThreadingHTTPServer(("", args.port), Handler).serve_forever()
@@ -4,172 +4,291 @@ from flask import (
     request,
     redirect,
     make_response,
+    abort,
+    send_file,
+    flash,
 )
+import click
 import os
+import sqlite3
 from dotenv import load_dotenv
-from flask_sitemap import Sitemap
+from flask.cli import FlaskGroup
 from common.auth import check_token
+import common.sitemap
 from common.artist import Artist
 import upgrade_db
-import mimetypes
-import subprocess
 from common.db import get_db_connection
+from common.feeds import feed_response
+from common.lookups import artist_names, series_names
+from common.pagecache import cached_page, tag_page
+from common.pagination import paginate_comics
+import common.db
 
-import blueprints.admin
-import blueprints.artists
-import blueprints.auth
-import blueprints.comics
-import blueprints.series
-import blueprints.create
+# the site is made by create_app(). Importing this file doesn't touch the
+# database or the environment; the `app` that waitress and flask look for is
+# only made the first time it's asked for (see __getattr__ at the bottom).
+# The database isn't upgraded automatically any more either, that's done by
+# `python upgrade_db.py` or `flask upgrade-db` (prestart.sh in docker)
 
 
-upgrade_db.upgrade_if_needed()
+def config_from_env() -> dict:
+    """Read the site's settings from the environment and .env."""
+    load_dotenv()
+    maxlogintime = os.getenv("MAX_LOGIN_TIME")
+    if maxlogintime is None or not maxlogintime.isnumeric():
+        raise ValueError("invalid config! MAX_LOGIN_TIME must be a number")
+    if os.getenv("SECRET_KEY") is None:
+        raise ValueError("invalid config! SECRET_KEY is missing")
 
-load_dotenv()
-
-SITEMAP_URLS = (
-    "index",
-    "auth.login",
-    "artists.list",
-    "series.list",
-    "rss",
-    "auth.create_account",
-    "tos",
-)
+    if os.getenv("SERVER_ADDRESS") is None:
+        print("invalid config!")
 
+    if os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper() not in (
+        "DELETE",
+        "TRUNCATE",
+        "PERSIST",
+        "MEMORY",
+        "WAL",
+        "OFF",
+    ):
+        raise ValueError("invalid config! unknown SQLITE_JOURNAL_MODE")
+    if os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper() not in (
+        "OFF",
+        "NORMAL",
+        "FULL",
+        "EXTRA",
+    ):
+        raise ValueError("invalid config! unknown SQLITE_SYNCHRONOUS")
 
-maxlogintime = os.getenv("MAX_LOGIN_TIME")
-if maxlogintime is not None:
-    if not maxlogintime.isnumeric():
-        print("invalid config!")
-        exit()
-else:
-    print("invalid config!")
-    exit()
-if os.getenv("SECRET_KEY") is None:
-    print("invalid config!")
-    exit()
-
-if os.getenv("SERVER_ADDRESS") is None:
-    print("invalid config!")
-
-app = Flask(__name__)
-app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
-app.config["UPLOAD_FOLDER"] = "static/comics"
-app.config["MAX_LOGIN_TIME"] = int(maxlogintime)
-app.config["ALLOWED_EXTENSIONS"] = ("png", "jpg", "jpeg", "gif", "tiff", "webp")
-app.config["SERVER_ADDRESS"] = os.getenv("SERVER_ADDRESS")
-ext = Sitemap(app=app)
-
-
-@app.context_processor
-def inject_version_info():
-    return dict(
-        COMMIT_ID=subprocess.check_output(
-            ["git", "rev-parse", "--short", "HEAD"]
-        ).decode(),
-        VERSION=subprocess.check_output(
-            ["git", "describe", "--tags", "--abbrev=0"]
-        ).decode(),
+    config = {}
+    config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+    config["UPLOAD_FOLDER"] = "static/comics"
+    config["MAX_LOGIN_TIME"] = int(maxlogintime)
+    config["ALLOWED_EXTENSIONS"] = ("png", "jpg", "jpeg", "gif", "tiff", "webp")
+    config["SERVER_ADDRESS"] = os.getenv("SERVER_ADDRESS")
+    # biggest upload to accept, in bytes. Bigger ones are refused before being read
+    config["MAX_CONTENT_LENGTH"] = int(
+        os.getenv("MAX_CONTENT_LENGTH", 32 * 1024 * 1024)
+    )
+    # the same for bulk imports, and how many images they check at once
+    config["MAX_BULK_LENGTH"] = int(os.getenv("MAX_BULK_LENGTH", 1024 * 1024 * 1024))
+    config["BULK_WORKERS"] = int(os.getenv("BULK_WORKERS", 4))
+    # sqlite tuning, see common/db.py for what each of these does
+    config["DATABASE"] = os.getenv("DATABASE", common.db.DEFAULTS["DATABASE"])
+    for setting in ("SQLITE_JOURNAL_MODE", "SQLITE_SYNCHRONOUS"):
+        config[setting] = os.getenv(setting, common.db.DEFAULTS[setting]).upper()
+    for setting in ("SQLITE_BUSY_TIMEOUT", "SQLITE_MMAP_SIZE", "SQLITE_CACHE_SIZE"):
+        try:
+            config[setting] = int(os.getenv(setting, common.db.DEFAULTS[setting]))
+        except ValueError:
+            raise ValueError(f"invalid config! {setting} must be a number")
+    # seconds before the artist and series name lookups are re-read from the database
+    config["LOOKUP_CACHE_TTL"] = int(os.getenv("LOOKUP_CACHE_TTL", 300))
+    # how many logged in artists to remember, and for how many seconds
+    config["ARTIST_CACHE_SIZE"] = int(os.getenv("ARTIST_CACHE_SIZE", 1024))
+    config["ARTIST_CACHE_TTL"] = int(os.getenv("ARTIST_CACHE_TTL", 60))
+    # how many comics to put in each rss feed, and how long to cache them for
+    config["FEED_MAX_ITEMS"] = int(os.getenv("FEED_MAX_ITEMS", 50))
+    config["FEED_CACHE_TTL"] = int(os.getenv("FEED_CACHE_TTL", 300))
+    # how many comics go on each page of a feed's archive
+    config["FEED_ARCHIVE_SIZE"] = int(os.getenv("FEED_ARCHIVE_SIZE", 100))
+    # where generated files like the sitemap shards are kept
+    config["CACHE_FOLDER"] = os.getenv("CACHE_FOLDER", "cache")
+    # urls per sitemap shard (at most 50,000), and seconds between checking them
+    config["SITEMAP_SHARD_SIZE"] = int(os.getenv("SITEMAP_SHARD_SIZE", 50000))
+    config["SITEMAP_TTL"] = int(os.getenv("SITEMAP_TTL", 3600))
+    # downscaled copies made of every upload, and how many threads make them
+    config["RENDITION_WIDTHS"] = tuple(
+        int(width)
+        for width in os.getenv("RENDITION_WIDTHS", "240,480,960,1920").split(",")
     )
+    config["RENDITION_FORMAT"] = os.getenv("RENDITION_FORMAT", "webp").lower()
+    config["IMAGE_WORKERS"] = int(os.getenv("IMAGE_WORKERS", 2))
+    # werkzeug hash method for new passwords. Older hashes are upgraded on login
+    config["PASSWORD_HASH_METHOD"] = os.getenv(
+        "PASSWORD_HASH_METHOD", "scrypt:32768:8:1"
+    )
+    # processes that hash passwords, and how many more logins may wait for them
+    config["PASSWORD_WORKERS"] = int(os.getenv("PASSWORD_WORKERS", 2))
+    config["PASSWORD_QUEUE"] = int(os.getenv("PASSWORD_QUEUE", 8))
+    # rendered pages kept for visitors who aren't logged in, in memory and
+    # optionally on disk in CACHE_FOLDER so they survive a restart
+    config["PAGE_CACHE_SIZE"] = int(os.getenv("PAGE_CACHE_SIZE", 256))
+    config["PAGE_CACHE_TTL"] = int(os.getenv("PAGE_CACHE_TTL", 300))
+    config["PAGE_CACHE_DISK"] = os.getenv("PAGE_CACHE_DISK", "0") == "1"
+    config["PAGE_CACHE_DISK_SIZE"] = int(os.getenv("PAGE_CACHE_DISK_SIZE", 10000))
+    # rendered comic cards for listing pages, see common/templating.py, and
+    # seconds before they're rendered again to notice the admin tools' changes
+    config["CARD_CACHE_SIZE"] = int(os.getenv("CARD_CACHE_SIZE", 5000))
+    config["CARD_CACHE_TTL"] = int(os.getenv("CARD_CACHE_TTL", 300))
+    # compiled templates kept in CACHE_FOLDER, so restarts don't compile them again
+    config["JINJA_BYTECODE_CACHE"] = os.getenv("JINJA_BYTECODE_CACHE", "1") == "1"
+    # discord notifications for new uploads, sent in the background
+    config["DISCORD_WEBHOOK_URL"] = os.getenv("DISCORD_WEBHOOK_URL")
+    # seconds to wait for discord, and how often to retry before giving up
+    config["WEBHOOK_TIMEOUT"] = float(os.getenv("WEBHOOK_TIMEOUT", 10))
+    config["WEBHOOK_MAX_ATTEMPTS"] = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 10))
+    # retries wait twice as long each time, starting at WEBHOOK_BACKOFF seconds
+    config["WEBHOOK_BACKOFF"] = float(os.getenv("WEBHOOK_BACKOFF", 5))
+    config["WEBHOOK_MAX_BACKOFF"] = float(os.getenv("WEBHOOK_MAX_BACKOFF", 900))
+    # seconds to wait for more uploads to batch with, and between outbox checks
+    config["WEBHOOK_BATCH_DELAY"] = float(os.getenv("WEBHOOK_BATCH_DELAY", 2))
+    config["WEBHOOK_POLL_INTERVAL"] = float(os.getenv("WEBHOOK_POLL_INTERVAL", 30))
+    # admin jobs like deleting an artist change this many comics per transaction
+    config["JOB_CHUNK_SIZE"] = int(os.getenv("JOB_CHUNK_SIZE", 500))
+    # threads deleting a job's files, and seconds between checks for new jobs
+    config["JOB_FILE_WORKERS"] = int(os.getenv("JOB_FILE_WORKERS", 8))
+    config["JOB_POLL_INTERVAL"] = float(os.getenv("JOB_POLL_INTERVAL", 5))
+    # time spent on each request and its queries, in a Server-Timing header
+    config["SERVER_TIMING"] = os.getenv("SERVER_TIMING", "0") == "1"
+    # profiles of pages requested by admins with ?profile, kept in CACHE_FOLDER
+    config["PROFILE_KEEP"] = int(os.getenv("PROFILE_KEEP", 20))
+    if config["PROFILE_KEEP"] < 1:
+        raise ValueError("invalid config! PROFILE_KEEP must be at least 1")
+    config["PROFILE_SAMPLE_INTERVAL"] = float(
+        os.getenv("PROFILE_SAMPLE_INTERVAL", 0.001)
+    )
+    return config
+
+
+def create_app(config: dict | None = None) -> Flask:
+    """Make the site, from `config` or else from the environment."""
+    import blueprints.admin
+    import blueprints.api
+    import blueprints.artists
+    import blueprints.auth
+    import blueprints.comics
+    import blueprints.create
+    import blueprints.search
+    import blueprints.series
+    import common.auth
+    import common.feeds
+    import common.images
+    import common.jobs
+    import common.metrics
+    import common.pagecache
+    import common.passwords
+    import common.storage
+    import common.templating
+    import common.version
+    import common.webhooks
 
+    app = Flask(__name__)
+    app.config.update(config_from_env() if config is None else config)
+    check_database(app.config["DATABASE"])
+    common.db.init_app(app)
+    common.auth.init_app(app)
+    common.feeds.init_app(app)
+    common.images.init_app(app)
+    common.storage.init_app(app)
+    common.webhooks.init_app(app)
+    common.passwords.init_app(app)
+    common.pagecache.init_app(app)
+    common.jobs.init_app(app)
+    common.metrics.init_app(app)
+    common.version.init_app(app)
+    common.templating.init_app(app)
 
-app.register_blueprint(blueprints.admin.bp)
-app.register_blueprint(blueprints.artists.bp)
-app.register_blueprint(blueprints.auth.bp)
-app.register_blueprint(blueprints.comics.bp)
-app.register_blueprint(blueprints.create.bp)
-app.register_blueprint(blueprints.series.bp)
+    app.register_blueprint(blueprints.admin.bp)
+    app.register_blueprint(blueprints.api.bp)
+    app.register_blueprint(blueprints.artists.bp)
+    app.register_blueprint(blueprints.auth.bp)
+    app.register_blueprint(blueprints.comics.bp)
+    app.register_blueprint(blueprints.create.bp)
+    app.register_blueprint(blueprints.series.bp)
+    app.register_blueprint(blueprints.search.bp)
+    app.register_error_handler(413, upload_too_large)
+    app.add_url_rule("/", view_func=index)
+    app.add_url_rule("/feed", view_func=indexrssfeed)
+    app.add_url_rule("/feed/archive/<int:page>", view_func=indexrssfeed_archive)
+    app.add_url_rule("/rss", view_func=rss)
+    app.add_url_rule("/terms-of-service", view_func=tos)
+    app.add_url_rule("/toggletheme", view_func=toggletheme)
+    app.add_url_rule("/sitemap.xml", view_func=sitemap)
+    app.add_url_rule("/sitemaps/<string:name>.xml.gz", view_func=sitemap_shard)
 
+    @app.cli.command("upgrade-db")
+    def upgrade_db_command():
+        """Upgrade the database to the latest version."""
+        upgrade_db.upgrade_if_needed(app.config["DATABASE"])
 
-@app.route("/")
-@check_token(app)
+    return app
+
+
+def check_database(path: str):
+    # a new install's database is made by admin_tools/init.py
+    if not os.path.exists(path):
+        return
+    # `flask upgrade-db` is registered on the app, so flask makes the app
+    # while it's still looking for the command, and that has to work on an
+    # old database. Commands like `flask run` make it themselves, once
+    # they're running, and are checked like everything else
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None and isinstance(ctx.command, FlaskGroup):
+        return
+    connection = sqlite3.connect(path)
+    version = connection.execute("SELECT * FROM pragma_user_version").fetchone()[0]
+    connection.close()
+    if version < upgrade_db.LATEST:
+        raise RuntimeError(
+            f"{path} is at v{version} but the site needs v{upgrade_db.LATEST},"
+            " upgrade it with `python upgrade_db.py` first"
+        )
+
+
+def upload_too_large(e):
+    # bulk imports allow more, so ask the request what its limit was
+    limit = request.max_content_length // (1024 * 1024)
+    flash(f"That file is too big! Uploads can be at most {limit}MB.")
+    return redirect(request.url)
+
+
+@check_token()
+@cached_page
 def index(login_artist: Artist | None):
+    tag_page("index")
     conn = get_db_connection()
-    page = request.args.get("page", type=int)
-    if page is None:
-        page = 0
-    else:
-        page -= 1
-    # pages are 50 items long
-    offset = page * 50
-    # request one more comic than we need, purely to see if it exists
-    comics = conn.execute(
-        "SELECT * FROM comics ORDER BY created DESC LIMIT 51 OFFSET ?",
-        (offset,),
-    ).fetchall()
-    # if there are more comics, allow going to the next page
-    # and clean up the extra comic
-    if len(comics) > 50:
-        comics.pop()
-        allownext = True
-    else:
-        # if not, do not allow going to the next page
-        allownext = False
-    artists = conn.execute("SELECT id, username FROM artists").fetchall()
-    # convert the artist to a dict for easy searching
-    artistdict = {}
-    for other_artist in artists:
-        artistdict.update({other_artist[0]: other_artist[1]})
-
-    series_db = conn.execute("SELECT id, name FROM series").fetchall()
-    seriesdict = {}
-    # convert the series to a dict for easy searching
-    for series in series_db:
-        seriesdict.update({series[0]: series[1]})
+    page = paginate_comics(conn)
+    artistdict = artist_names()
+    seriesdict = series_names()
     conn.close()
     return render_template(
         "index.jinja",
-        comics=comics,
+        comics=page.comics,
         artists=artistdict,
         series=seriesdict,
-        page=page + 1,
-        allownext=allownext,
+        newer=page.newer,
+        older=page.older,
         login_artist=login_artist,
     )
 
 
-@app.route("/feed")
-def indexrssfeed():
-    conn = get_db_connection()
-    comics = conn.execute("SELECT * FROM comics ORDER BY created DESC").fetchall()
-    series_db = conn.execute("SELECT id, name FROM series").fetchall()
-    seriesdict = {}
-    # convert the series to a dict for easy searching
-    for series in series_db:
-        seriesdict.update({series[0]: series[1]})
-    artists = conn.execute("SELECT id, username FROM artists").fetchall()
-    # convert the artist to a dict for easy searching
-    artistdict = {}
-    for other_artist in artists:
-        artistdict.update({other_artist[0]: other_artist[1]})
-    conn.close()
-    response = make_response(
-        render_template(
-            "rss/index.jinja",
-            comics=comics,
-            series=seriesdict,
-            artists=artistdict,
-            types_map=mimetypes.types_map,
-        )
+def indexrssfeed(page: int | None = None):
+    return feed_response(
+        ("index",),
+        "1",
+        (),
+        "rss/index.jinja",
+        ("indexrssfeed", "indexrssfeed_archive"),
+        {},
+        page,
     )
-    response.headers["Content-Type"] = "application/xml"
-    return response
 
 
-@app.route("/rss")
-@check_token(app)
+def indexrssfeed_archive(page: int):
+    return indexrssfeed(page)
+
+
+@check_token()
 def rss(login_artist: Artist):
     return render_template("rss.jinja", login_artist=login_artist)
 
 
-@app.route("/terms-of-service")
-@check_token(app)
+@check_token()
 def tos(login_artist: Artist):
     return render_template("terms-of-service.jinja", login_artist=login_artist)
 
 
-@app.route("/toggletheme")
 def toggletheme():
     if request.referrer is not None:
         resp = make_response(redirect(request.referrer))
@@ -182,19 +301,26 @@ def toggletheme():
     return resp
 
 
-@ext.register_generator
 def sitemap():
-    for page in SITEMAP_URLS:
-        yield page, {}
-    conn = get_db_connection()
-    comics = conn.execute("SELECT id FROM comics ORDER BY created DESC").fetchall()
-    for comic in comics:
-        yield "comics.comic", {"comic_id": comic[0]}
-    artists = conn.execute(
-        "SELECT username FROM artists ORDER BY created DESC"
-    ).fetchall()
-    for artist in artists:
-        yield "artists.artist", {"artist": artist[0]}
-    series_db = conn.execute("SELECT name FROM series").fetchall()
-    for series in series_db:
-        yield "series.series", {"seriesName": series[0]}
+    response = make_response(common.sitemap.render_index())
+    response.headers["Content-Type"] = "application/xml"
+    return response
+
+
+def sitemap_shard(name):
+    if name not in common.sitemap.refresh():
+        abort(404)
+    return send_file(common.sitemap.shard_path(name), mimetype="application/gzip")
+
+
+_app = None
+
+
+def __getattr__(name):
+    # for waitress-serve app:app, flask run and admin_tools
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,68 @@
+import argparse
+import os
+import random
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from run import InProcessClient, load_app, routes, sample_values, url
+
+# requests every page of the site, anonymously and as an admin, and fails if
+# any of them starts another process. Rendering used to run git twice for
+# every page; run this after changing anything that every page uses
+#
+#   python bench/check_subprocess.py
+EVENTS = (
+    "subprocess.Popen",
+    "os.system",
+    "os.posix_spawn",
+    "os.spawn",
+    "os.exec",
+    "os.fork",
+    "os.forkpty",
+)
+
+_checking = threading.Event()
+_spawned = []
+
+
+def audit(event: str, args):
+    if _checking.is_set() and event in EVENTS:
+        _spawned.append((event, args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check no page starts a process")
+    parser.add_argument("--database", default="bench/db/database.db")
+    parser.add_argument("--admin", default="benchadmin", help="password bench")
+    args = parser.parse_args()
+
+    app = load_app(args.database, page_cache=False)
+    sys.addaudithook(audit)
+    rng = random.Random(0)
+    values = sample_values(app, args.database)
+    anonymous = InProcessClient(app)
+    admin = InProcessClient(app)
+    # logging in starts the password hashing processes, which is fine
+    admin.login(args.admin, "bench")
+
+    failed = False
+    for rule in routes(app, values, None):
+        for client in (anonymous, admin):
+            path = url(rule, values, rng)
+            _spawned.clear()
+            _checking.set()
+            try:
+                status, _ = client.get(path)
+            finally:
+                _checking.clear()
+            if _spawned:
+                failed = True
+                print(f"{path} ({status}) started a process: {_spawned}")
+    if failed:
+        sys.exit(1)
+    print("no page started a process")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# times every page of the site against a database made by bench/seed.py,
+# either calling the app directly or through waitress, and saves the
+# results as json so two runs can be compared:
+#
+#   python bench/run.py --mode waitress --threads 8
+#   python bench/run.py --compare bench/results/<earlier run>.json
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# pages that change the visitor's cookies rather than show anything
+SKIP = {"auth.logout", "toggletheme"}
+SEARCHES = ("moon", "cat riv", "dragon", "sec", "ghost tower", "lantern isl")
+
+# statements run by the thread handling the current request, see count_queries
+_counts = threading.local()
+
+
+def count_queries(conn):
+    def trace(statement):
+        # leave out what sqlite runs by itself, for triggers and fts5's index
+        if statement.startswith("--") or "'main'." in statement:
+            return
+        _counts.queries = getattr(_counts, "queries", 0) + 1
+
+    conn.set_trace_callback(trace)
+
+
+def counting(wsgi_app):
+    """Report the queries each request made in an X-Bench-Queries header."""
+
+    def middleware(environ, start_response):
+        _counts.queries = 0
+
+        def counted_start_response(status, headers, exc_info=None):
+            headers.append(("X-Bench-Queries", str(_counts.queries)))
+            return start_response(status, headers, exc_info)
+
+        return wsgi_app(environ, counted_start_response)
+
+    return middleware
+
+
+def sample_values(app, database: str) -> dict[str, list]:
+    """Real values for each kind of url argument, to pick from at random."""
+    from common.sitemap import refresh
+    from common.storage import hashed_name
+
+    conn = sqlite3.connect(database)
+
+    def column(query: str) -> list:
+        return [row[0] for row in conn.execute(query)]
+
+    artists = column("SELECT username FROM artists ORDER BY random() LIMIT 1000")
+    artist_ids = column("SELECT id FROM artists ORDER BY random() LIMIT 1000")
+    series = column("SELECT name FROM series ORDER BY random() LIMIT 1000")
+    series_ids = column("SELECT id FROM series ORDER BY random() LIMIT 1000")
+    comics = column("SELECT id FROM comics ORDER BY random() LIMIT 1000")
+    images = [
+        f"comics/{hashed_name(*row)}"
+        for row in conn.execute(
+            "SELECT DISTINCT filehash, fileext FROM comics"
+            " WHERE filehash IS NOT NULL LIMIT 100"
+        )
+    ]
+    conn.close()
+    with app.test_request_context():
+        shards = list(refresh())
+    return {
+        "artist": artists,
+        "artist_id": artist_ids,
+        "series_id": series_ids,
+        "seriesName": series,
+        "SeriesName": series,
+        "comic_id": comics,
+        "id": comics,
+        "page": [1],
+        "name": shards,
+        "filename": images,
+    }
+
+
+def routes(app, values: dict, only: str | None) -> list:
+    found = []
+    for rule in app.url_map.iter_rules():
+        if "GET" not in rule.methods or rule.endpoint in SKIP:
+            continue
+        if only is not None and only not in rule.rule:
+            continue
+        if not all(values.get(argument) for argument in rule.arguments):
+            print(f"skipping {rule.rule}, there is nothing to fill it in with")
+            continue
+        found.append(rule)
+    return found
+
+
+def url(rule, values: dict, rng: random.Random) -> str:
+    arguments = {argument: rng.choice(values[argument]) for argument in rule.arguments}
+    path = rule.build(arguments)[1]
+    if rule.endpoint == "search.search":
+        path += "?q=" + rng.choice(SEARCHES).replace(" ", "+")
+    return path
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username: str, password: str):
+        self.client.post(
+            "/auth/login", data={"username": username, "password": password}
+        )
+
+    def get(self, path: str) -> tuple[int, int]:
+        response = self.client.get(path)
+        response.close()
+        return response.status_code, int(response.headers["X-Bench-Queries"])
+
+
+class HTTPClient:
+    def __init__(self, base: str):
+        import requests
+
+        self.base = base
+        self.session = requests.Session()
+
+    def login(self, username: str, password: str):
+        self.session.post(
+            self.base + "/auth/login",
+            data={"username": username, "password": password},
+            allow_redirects=False,
+        )
+
+    def get(self, path: str) -> tuple[int, int]:
+        response = self.session.get(self.base + path, allow_redirects=False)
+        return response.status_code, int(response.headers["X-Bench-Queries"])
+
+
+def summarise(results: list, elapsed: float) -> dict:
+    latencies = [seconds for _, _, seconds in results]
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "statuses": statuses,
+        "errors": sum(1 for status, _, _ in results if status >= 500),
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "throughput": len(results) / elapsed,
+        "queries_per_request": statistics.fmean(q for _, q, _ in results),
+    }
+
+
+def dataset(database: str) -> dict:
+    conn = sqlite3.connect(database)
+    counts = {
+        table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        for table in ("artists", "series", "comics")
+    }
+    conn.close()
+    return counts
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict):
+    print(f"\ncompared with {old['started']} ({old['mode']}, commit {old['commit']})")
+    print(f"{'route':<52} {'p50 ms':>18} {'p95 ms':>18} {'queries':>12}")
+    for route, stats in new["routes"].items():
+        if route not in old["routes"]:
+            continue
+        before = old["routes"][route]
+        columns = []
+        for key in ("p50_ms", "p95_ms"):
+            change = (stats[key] - before[key]) / before[key] * 100
+            columns.append(f"{before[key]:.1f}→{stats[key]:.1f} {change:+.0f}%")
+        queries = (
+            f"{before['queries_per_request']:.1f}→{stats['queries_per_request']:.1f}"
+        )
+        print(f"{route:<52} {columns[0]:>18} {columns[1]:>18} {queries:>12}")
+
+
+def load_app(database: str, page_cache: bool = True):
+    """Import the app, pointed at a seeded database and counting queries."""
+    os.chdir(ROOT)
+    sys.path.append(os.getcwd())
+    if not os.path.exists(database):
+        print(f"{database} doesn't exist, make it with bench/seed.py")
+        sys.exit(1)
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    os.environ["DATABASE"] = database
+    os.environ["CACHE_FOLDER"] = "bench/cache"
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("MAX_LOGIN_TIME", "86400")
+    os.environ.setdefault("SERVER_ADDRESS", "http://localhost")
+    if not page_cache:
+        os.environ["PAGE_CACHE_SIZE"] = "0"
+
+    import common.db
+
+    common.db.connection_hooks.append(count_queries)
+    from app import create_app
+
+    app = create_app()
+    app.wsgi_app = counting(app.wsgi_app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every page of the site")
+    parser.add_argument("--database", default="bench/db/database.db")
+    parser.add_argument(
+        "--mode", choices=("inprocess", "waitress"), default="inprocess"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=4, help="waitress threads and clients"
+    )
+    parser.add_argument("--requests", type=int, default=100, help="for each route")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed, per route")
+    parser.add_argument("--login", help="artist to log in as (password bench)")
+    parser.add_argument(
+        "--no-page-cache", action="store_true", help="render every page"
+    )
+    parser.add_argument("--routes", help="only routes containing this")
+    parser.add_argument("--seed", type=int, default=0, help="for the random urls")
+    parser.add_argument("--output", help="where to save the results")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    args = parser.parse_args()
+
+    app = load_app(args.database, not args.no_page_cache)
+    rng = random.Random(args.seed)
+    values = sample_values(app, args.database)
+    rules = routes(app, values, args.routes)
+
+    server = None
+    if args.mode == "waitress":
+        from waitress import create_server
+
+        server = create_server(app, host="127.0.0.1", port=0, threads=args.threads)
+        threading.Thread(target=server.run, daemon=True).start()
+        base = f"http://127.0.0.1:{server.effective_port}"
+    clients = threading.local()
+
+    def client():
+        if not hasattr(clients, "client"):
+            if server is None:
+                clients.client = InProcessClient(app)
+            else:
+                clients.client = HTTPClient(base)
+            if args.login:
+                clients.client.login(args.login, "bench")
+        return clients.client
+
+    def request(path: str) -> tuple[int, int, float]:
+        started = time.perf_counter()
+        status, queries = client().get(path)
+        return status, queries, time.perf_counter() - started
+
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit(),
+        "mode": args.mode,
+        "threads": args.threads,
+        "login": args.login,
+        "page_cache": not args.no_page_cache,
+        "dataset": dataset(args.database),
+        "routes": {},
+    }
+    everything = []
+    total_elapsed = 0
+    print(
+        f"{'route':<52} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8}"
+    )
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for rule in rules:
+            paths = [url(rule, values, rng) for _ in range(args.warmup + args.requests)]
+            list(pool.map(request, paths[: args.warmup]))
+            started = time.perf_counter()
+            timed = list(pool.map(request, paths[args.warmup :]))
+            elapsed = time.perf_counter() - started
+            total_elapsed += elapsed
+            everything += timed
+            stats = summarise(timed, elapsed)
+            results["routes"][rule.rule] = stats
+            print(
+                f"{rule.rule:<52} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f}"
+                f" {stats['p99_ms']:>8.1f} {stats['throughput']:>8.0f}"
+                f" {stats['queries_per_request']:>8.1f}"
+            )
+    if server is not None:
+        server.close()
+    results["total"] = summarise(everything, total_elapsed)
+
+    output = args.output or os.path.join(
+        "bench", "results", f"{results['started']}-{args.mode}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    # logins hash passwords in worker processes, which import this file again
+    main()
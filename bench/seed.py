@@ -0,0 +1,143 @@
+import argparse
+import hashlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import time
+
+# the web app's paths are relative to the top of the repository
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.getcwd())
+
+from PIL import Image
+from werkzeug.security import generate_password_hash
+
+from common.storage import hashed_name
+
+# fills a fresh database with made up artists, series and comics, for
+# bench/run.py. Every artist's password is "bench", and "benchadmin" is an
+# admin. The comics share a handful of placeholder images, which are put in
+# static/comics (the only folder the site serves images from) under their
+# hashes, so they never clash with real uploads
+PASSWORD = "bench"
+WORDS = (
+    "moon cat river night tower ghost paper garden robot summer winter city"
+    " dragon ocean secret letter forest lantern station island mirror clock"
+).split()
+BATCH = 10000
+
+parser = argparse.ArgumentParser(description="Make a database full of test data")
+parser.add_argument("--database", default="bench/db/database.db")
+parser.add_argument("--artists", type=int, default=5000)
+parser.add_argument("--series", type=int, default=2000)
+parser.add_argument("--comics", type=int, default=500000)
+parser.add_argument("--images", type=int, default=16, help="placeholder images")
+parser.add_argument("--seed", type=int, default=0, help="for the random numbers")
+parser.add_argument("--force", action="store_true", help="replace the database")
+args = parser.parse_args()
+
+
+def title(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+def placeholder(number: int) -> str:
+    """Save a placeholder image, returning its hash."""
+    image = Image.new("RGB", (800, 1200), ((number * 53) % 256, 96, 160))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    data = buffer.getvalue()
+    filehash = hashlib.sha256(data).hexdigest()
+    path = os.path.join("static/comics", hashed_name(filehash, "png"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return filehash
+
+
+def batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+if os.path.exists(args.database):
+    if not args.force:
+        print(f"{args.database} already exists, use --force to replace it")
+        sys.exit(1)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.database + suffix):
+            os.remove(args.database + suffix)
+os.makedirs(os.path.dirname(args.database), exist_ok=True)
+rng = random.Random(args.seed)
+started = time.perf_counter()
+
+conn = sqlite3.connect(args.database)
+with open("schema.sql") as f:
+    conn.executescript(f.read())
+# nothing here is worth keeping if it crashes half way
+conn.execute("PRAGMA journal_mode = OFF")
+conn.execute("PRAGMA synchronous = OFF")
+
+passhash = generate_password_hash(PASSWORD)
+conn.execute(
+    "INSERT INTO artists (username, passhash, isadmin) VALUES (?, ?, 1)",
+    ("benchadmin", passhash),
+)
+conn.executemany(
+    "INSERT INTO artists (username, passhash, isadmin) VALUES (?, ?, 0)",
+    ((f"artist{i}", passhash) for i in range(1, args.artists + 1)),
+)
+artistids = [row[0] for row in conn.execute("SELECT id FROM artists")]
+
+series_of = {}
+for i in range(1, args.series + 1):
+    artistid = rng.choice(artistids)
+    cur = conn.execute(
+        "INSERT INTO series (name, artistid) VALUES (?, ?)",
+        (f"{title(rng)} {i}", artistid),
+    )
+    series_of.setdefault(artistid, []).append(cur.lastrowid)
+
+hashes = [placeholder(i) for i in range(args.images)]
+# spread over the last few years, oldest first like real uploads
+start = time.time() - 3 * 365 * 24 * 60 * 60
+step = (time.time() - start) / max(args.comics, 1)
+
+
+def comics():
+    for i in range(args.comics):
+        artistid = rng.choice(artistids)
+        seriesid = None
+        if artistid in series_of and rng.random() < 0.6:
+            seriesid = rng.choice(series_of[artistid])
+        created = time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.gmtime(start + i * step + rng.random())
+        )
+        filehash = rng.choice(hashes) if hashes else None
+        yield created, title(rng), "png", artistid, seriesid, filehash
+
+
+for number, batch in enumerate(batches(comics()), start=1):
+    conn.executemany(
+        "INSERT INTO comics (created, title, fileext, artistid, seriesid, filehash)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        batch,
+    )
+    print(f"{min(number * BATCH, args.comics)}/{args.comics} comics", end="\r")
+print()
+conn.commit()
+conn.execute("PRAGMA journal_mode = WAL")
+conn.execute("ANALYZE")
+conn.close()
+print(
+    f"made {args.artists} artists, {args.series} series and {args.comics} comics"
+    f" in {time.perf_counter() - started:.0f}s"
+)
@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from run import ROOT, commit
+
+# how long a fresh process takes to import app.py, make the app with
+# create_app() and answer its first request. Each sample is a new python
+# process, so nothing is already imported or cached:
+#
+#   python bench/startup.py --runs 20
+#   python bench/startup.py --compare bench/results/<earlier run>.json
+STEPS = ("import_ms", "create_app_ms", "first_request_ms", "process_ms")
+
+
+def sample(database: str) -> dict:
+    """Start the site in this process, timing each step. Run by measure()."""
+    started = time.perf_counter()
+    os.chdir(ROOT)
+    sys.path.append(os.getcwd())
+    os.environ["DATABASE"] = database
+    os.environ["CACHE_FOLDER"] = "bench/cache"
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("MAX_LOGIN_TIME", "86400")
+    os.environ.setdefault("SERVER_ADDRESS", "http://localhost")
+
+    import app
+
+    imported = time.perf_counter()
+    site = app.create_app()
+    created = time.perf_counter()
+    response = site.test_client().get("/")
+    response.close()
+    answered = time.perf_counter()
+    return {
+        "import_ms": (imported - started) * 1000,
+        "create_app_ms": (created - imported) * 1000,
+        "first_request_ms": (answered - created) * 1000,
+        "status": response.status_code,
+    }
+
+
+def measure(database: str) -> dict:
+    started = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--child", "--database", database],
+        text=True,
+    )
+    result = json.loads(output.splitlines()[-1])
+    # everything, including starting python and shutting down again
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def compare(old: dict, new: dict):
+    print(f"\ncompared with {old['started']} (commit {old['commit']})")
+    for step in STEPS:
+        before, after = old["median"][step], new["median"][step]
+        change = (after - before) / before * 100
+        print(f"{step:<18} {before:>8.1f} → {after:>8.1f} {change:+.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time how long the site takes to start"
+    )
+    parser.add_argument("--database", default="bench/db/database.db")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="where to save the results")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(sample(args.database)))
+        return
+    if not os.path.exists(os.path.join(ROOT, args.database)):
+        print(f"{args.database} doesn't exist, make it with bench/seed.py")
+        sys.exit(1)
+
+    samples = [measure(args.database) for _ in range(args.runs)]
+    errors = [s["status"] for s in samples if s["status"] >= 500]
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit(),
+        "runs": args.runs,
+        "errors": len(errors),
+        "median": {step: statistics.median(s[step] for s in samples) for step in STEPS},
+        "max": {step: max(s[step] for s in samples) for step in STEPS},
+        "samples": samples,
+    }
+    print(f"{'step':<18} {'median ms':>10} {'max ms':>10}")
+    for step in STEPS:
+        print(
+            f"{step:<18} {results['median'][step]:>10.1f} {results['max'][step]:>10.1f}"
+        )
+    if errors:
+        print(f"{len(errors)} first requests failed")
+
+    output = args.output or os.path.join(
+        ROOT, "bench", "results", f"{results['started']}-startup.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,76 @@
 import os
+
 from flask import (
     Blueprint,
-    current_app,
+    abort,
     flash,
+    make_response,
     redirect,
     render_template,
     request,
+    send_from_directory,
     url_for,
 )
-from common.auth import check_token
+from common.auth import artist_caches, check_token, evict_artist
 from common.artist import Artist
 from common.db import get_db_connection
-from werkzeug.security import generate_password_hash
+from common import jobs
+from common import metrics
+from common import profiling
+from common import pagecache
+from common.passwords import hash_password
+from common import storage
+from common import lookups
+from common.templating import card_caches
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
 
 @bp.route("/")
-@check_token(current_app, required=True, adminrequired=True)
+@check_token(required=True, adminrequired=True)
 def admin(login_artist):
-    return render_template("admin_panel.jinja", login_artist=login_artist)
+    return render_template(
+        "admin_panel.jinja",
+        login_artist=login_artist,
+        artist_cache=artist_caches.get().stats(),
+        page_cache=pagecache.page_caches.get().stats(),
+        card_cache=card_caches.get().stats(),
+        jobs=jobs.recent_jobs(get_db_connection()),
+        profiles=profiling.recent(),
+    )
+
+
+@bp.route("/metrics")
+@check_token(required=True, adminrequired=True)
+def metrics_text(login_artist: Artist):
+    response = make_response(metrics.render())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+@bp.route("/profiles/<string:filename>")
+@check_token(required=True, adminrequired=True)
+def profile(login_artist: Artist, filename: str):
+    if filename.endswith(".txt"):
+        name = filename.removesuffix(".txt")
+        if not os.path.isfile(os.path.join(profiling.folder(), f"{name}.prof")):
+            abort(404)
+        response = make_response(profiling.summary(name))
+        response.headers["Content-Type"] = "text/plain; charset=utf-8"
+        return response
+    return send_from_directory(profiling.folder(), filename, as_attachment=True)
+
+
+def evict_username(conn, username: str):
+    # usernames aren't unique in the database, so evict every match
+    for artist in conn.execute(
+        "SELECT id FROM artists WHERE username = ?", (username,)
+    ).fetchall():
+        evict_artist(artist[0])
 
 
 @bp.route("/create_signup_code", methods=("POST",))
-@check_token(current_app, required=True, adminrequired=True)
+@check_token(required=True, adminrequired=True)
 def create_signup_code(login_artist: Artist):
     conn = get_db_connection()
     code = request.form["code"]
@@ -35,11 +82,11 @@ def create_signup_code(login_artist: Artist):
 
 
 @bp.route("/create_artist", methods=("POST",))
-@check_token(current_app, required=True, adminrequired=True)
+@check_token(required=True, adminrequired=True)
 def create_artist(login_artist: Artist):
     conn = get_db_connection()
     username = request.form["username"]
-    passhash = generate_password_hash(request.form["password"])
+    passhash = hash_password(request.form["password"])
     try:
         isadmin = request.form["isadmin"]
     except:
@@ -50,12 +97,14 @@ def create_artist(login_artist: Artist):
     )
     conn.commit()
     conn.close()
+    lookups.invalidate_artists()
+    pagecache.purge("artists")
     flash(f'Artist "{username}" was successfully created!')
     return redirect(url_for("admin.admin"))
 
 
 @bp.route("/lock_artist", methods=("POST",))
-@check_token(current_app, required=True, adminrequired=True)
+@check_token(required=True, adminrequired=True)
 def lock_artist(login_artist: Artist):
     conn = get_db_connection()
     username = request.form["username"]
@@ -64,13 +113,14 @@ def lock_artist(login_artist: Artist):
         (username,),
     )
     conn.commit()
+    evict_username(conn, username)
     conn.close()
     flash(f'Artist "{username}" was successfully locked!')
     return redirect(url_for("admin.admin"))
 
 
 @bp.route("/unlock_artist", methods=("POST",))
-@check_token(current_app, required=True, adminrequired=True)
+@check_token(required=True, adminrequired=True)
 def unlock_artist(login_artist: Artist):
     conn = get_db_connection()
     username = request.form["username"]
@@ -79,42 +129,61 @@ def unlock_artist(login_artist: Artist):
         (username,),
     )
     conn.commit()
+    evict_username(conn, username)
     conn.close()
     flash(f'Artist "{username}" was successfully unlocked!')
     return redirect(url_for("admin.admin"))
 
 
 @bp.route("/delete_artist", methods=("POST",))
-@check_token(current_app, required=True, adminrequired=True)
+@check_token(required=True, adminrequired=True)
 def delete_artist(login_artist: Artist):
     conn = get_db_connection()
     username = request.form["username"]
     artistid = conn.execute(
         "SELECT id FROM artists WHERE username = ?", (username,)
     ).fetchone()[0]
-    comics = conn.execute(
-        "SELECT id, fileext FROM comics WHERE artistid = ?",
-        (artistid,),
-    ).fetchall()
-    for comic in comics:
-        try:
-            os.remove(f"static/comics/{comic[0]}.{comic[1]}")
-        except Exception as e:
-            flash(str(e))
+    # lock them out while their comics are deleted in the background
+    conn.execute("UPDATE artists SET islocked = 1 WHERE id = ?", (artistid,))
+    jobs.enqueue(conn, "delete_artist", artistid=artistid, username=username)
+    conn.commit()
+    conn.close()
+    evict_artist(artistid)
+    jobs.notify()
+    flash(f'Artist "{username}" will be deleted in the background.')
+    return redirect(url_for("admin.admin"))
 
-    conn.execute(
-        "DELETE FROM comics WHERE artistid = ?",
-        (artistid,),
-    )
-    conn.execute(
-        "DELETE FROM series WHERE artistid = ?",
-        (artistid,),
-    )
-    conn.execute(
-        "DELETE FROM artists WHERE id = ?",
-        (artistid,),
-    )
+
+@bp.route("/apply_series", methods=("POST",))
+@check_token(required=True, adminrequired=True)
+def apply_series(login_artist: Artist):
+    conn = get_db_connection()
+    name = request.form["series"]
+    series = conn.execute("SELECT id FROM series WHERE name = ?", (name,)).fetchone()
+    if series is None:
+        conn.close()
+        flash(f'There is no series called "{name}"!')
+        return redirect(url_for("admin.admin"))
+    jobs.enqueue(conn, "apply_series", seriesid=series["id"], series=name)
     conn.commit()
     conn.close()
-    flash(f'Artist "{username}" was successfully deleted.')
+    jobs.notify()
+    flash(f'Every comic will be put in "{name}" in the background.')
+    return redirect(url_for("admin.admin"))
+
+
+@bp.route("/check_lookups", methods=("POST",))
+@check_token(required=True, adminrequired=True)
+def check_lookups(login_artist: Artist):
+    problems = lookups.check_consistency()
+    for problem in problems:
+        flash(problem)
+    if problems:
+        # the cache is wrong, so start again from the database
+        lookups.invalidate_artists()
+        lookups.invalidate_series()
+        pagecache.purge_all()
+        flash("The name lookup cache was inconsistent and has been cleared.")
+    else:
+        flash("The name lookup cache is consistent with the database.")
     return redirect(url_for("admin.admin"))
@@ -0,0 +1,288 @@
+import json
+
+from flask import Blueprint, abort, current_app, request, url_for
+from werkzeug.exceptions import HTTPException
+
+from common.db import get_db_connection
+from common.lookups import artist_names, series_names
+from common.pagination import PAGE_SIZE
+from common.storage import image_url
+
+# a read-only json api, for apps and mirrors that would otherwise scrape the
+# html pages and feeds:
+#
+#   /api/v1/comics                  newest first, ?artist_id= and ?series_id=
+#   /api/v1/comics/<id>
+#   /api/v1/artists                 oldest first, ?username=
+#   /api/v1/artists/<id>
+#   /api/v1/series                  oldest first, ?name= and ?artist_id=
+#   /api/v1/series/<id>
+#
+# Lists come LIMIT (at most MAX_LIMIT) at a time, with a "next" cursor to
+# pass back as ?cursor= until it's null. ?ids=3,1,2 fetches up to MAX_IDS by
+# id instead, in that order, listing any that don't exist under "missing".
+# ?fields=id,title only includes those fields. Every response has a strong
+# ETag of its body, so clients sending If-None-Match get a 304 when nothing
+# changed. Rows are turned straight into json, there are no templates here
+MAX_LIMIT = 100
+MAX_IDS = 100
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+def _absolute(path: str) -> str:
+    return current_app.config["SERVER_ADDRESS"] + path
+
+
+def _image(comic_id: int, filehash: str | None, fileext: str) -> str:
+    comic = {"id": comic_id, "filehash": filehash, "fileext": fileext}
+    return _absolute(image_url(comic))
+
+
+def _renditions(
+    comic_id: int, filehash: str | None, fileext: str, renditions: str | None
+) -> list[dict]:
+    comic = {"id": comic_id, "filehash": filehash, "fileext": fileext}
+    return [
+        {"width": int(suffix.split(".")[0]), "url": _absolute(image_url(comic, suffix))}
+        for suffix in (renditions or "").split(",")
+        if suffix
+    ]
+
+
+# each field is the columns it's made from, and how to make it from them.
+# None means it's just the one column as it is
+RESOURCES = {
+    "comics": {
+        "key": ("created", "id"),
+        "descending": True,
+        "filters": {"artist_id": ("artistid", int), "series_id": ("seriesid", int)},
+        "fields": {
+            "id": (("id",), None),
+            "title": (("title",), None),
+            "created": (("created",), None),
+            "url": (
+                ("id",),
+                lambda id: _absolute(url_for("comics.comic", comic_id=id)),
+            ),
+            "artist_id": (("artistid",), None),
+            "artist": (("artistid",), lambda artistid: artist_names().get(artistid)),
+            "series_id": (("seriesid",), None),
+            "series": (("seriesid",), lambda seriesid: series_names().get(seriesid)),
+            "image": (("id", "filehash", "fileext"), _image),
+            "width": (("width",), None),
+            "renditions": (("id", "filehash", "fileext", "renditions"), _renditions),
+        },
+    },
+    "artists": {
+        "key": ("id",),
+        "descending": False,
+        "filters": {"username": ("username", str)},
+        "fields": {
+            "id": (("id",), None),
+            "username": (("username",), None),
+            "created": (("created",), None),
+            "url": (
+                ("username",),
+                lambda username: _absolute(url_for("artists.artist", artist=username)),
+            ),
+        },
+    },
+    "series": {
+        "key": ("id",),
+        "descending": False,
+        "filters": {"name": ("name", str), "artist_id": ("artistid", int)},
+        "fields": {
+            "id": (("id",), None),
+            "name": (("name",), None),
+            "url": (
+                ("name",),
+                lambda name: _absolute(url_for("series.series", seriesName=name)),
+            ),
+            "artist_id": (("artistid",), None),
+            "artist": (("artistid",), lambda artistid: artist_names().get(artistid)),
+        },
+    },
+}
+
+
+@bp.errorhandler(HTTPException)
+def error(e: HTTPException):
+    return _respond({"error": e.description}, e.code)
+
+
+def _respond(data, status: int = 200):
+    response = current_app.response_class(
+        json.dumps(data, separators=(",", ":")),
+        status=status,
+        mimetype="application/json",
+    )
+    if status == 200:
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+def _plan(resource: dict, extra: tuple = ()) -> tuple[list[str], list]:
+    """The columns to select for ?fields=, and how to make each field."""
+    fields = resource["fields"]
+    wanted = request.args.get("fields")
+    if wanted is None:
+        names = list(fields)
+    else:
+        names = [name for name in wanted.split(",") if name]
+        if not names:
+            abort(400, "fields must name at least one field")
+        for name in names:
+            if name not in fields:
+                abort(400, f"there is no field called {name}")
+    columns = []
+    for name in names:
+        for column in fields[name][0]:
+            if column not in columns:
+                columns.append(column)
+    # like the key, for the cursor
+    for column in extra:
+        if column not in columns:
+            columns.append(column)
+    plan = [
+        (name, [columns.index(column) for column in fields[name][0]], fields[name][1])
+        for name in names
+    ]
+    return columns, plan
+
+
+def _build(row, plan: list) -> dict:
+    item = {}
+    for name, positions, make in plan:
+        if make is None:
+            item[name] = row[positions[0]]
+        else:
+            item[name] = make(*(row[position] for position in positions))
+    return item
+
+
+def _parse_ids(ids: str) -> list[int]:
+    try:
+        parsed = [int(row_id) for row_id in ids.split(",") if row_id]
+    except ValueError:
+        abort(400, "ids must be numbers")
+    if len(parsed) > MAX_IDS:
+        abort(400, f"at most {MAX_IDS} ids can be fetched at once")
+    return parsed
+
+
+def _parse_cursor(cursor: str, key: tuple) -> tuple:
+    parts = cursor.rsplit(",", len(key) - 1)
+    try:
+        # the last part of every key is an id
+        if len(parts) == len(key):
+            return (*parts[:-1], int(parts[-1]))
+    except ValueError:
+        pass
+    abort(400, "that cursor isn't valid")
+
+
+def _by_ids(name: str, ids: list[int]):
+    resource = RESOURCES[name]
+    columns, plan = _plan(resource, ("id",))
+    found = {}
+    if ids:
+        conn = get_db_connection()
+        rows = conn.execute(
+            f"SELECT {', '.join(columns)} FROM {name}"
+            f" WHERE id IN ({', '.join('?' * len(ids))})",
+            ids,
+        ).fetchall()
+        conn.close()
+        position = columns.index("id")
+        found = {row[position]: _build(row, plan) for row in rows}
+    return _respond(
+        {
+            name: [found[row_id] for row_id in ids if row_id in found],
+            "missing": [row_id for row_id in ids if row_id not in found],
+        }
+    )
+
+
+def _list(name: str):
+    resource = RESOURCES[name]
+    if "ids" in request.args:
+        return _by_ids(name, _parse_ids(request.args["ids"]))
+    key = resource["key"]
+    columns, plan = _plan(resource, key)
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    if not 1 <= limit <= MAX_LIMIT:
+        abort(400, f"limit must be between 1 and {MAX_LIMIT}")
+
+    where, params = ["1"], []
+    for argument, (column, kind) in resource["filters"].items():
+        value = request.args.get(argument)
+        if value is not None:
+            try:
+                params.append(kind(value))
+            except ValueError:
+                abort(400, f"{argument} must be a number")
+            where.append(f"{column} = ?")
+    cursor = request.args.get("cursor")
+    comparison = "<" if resource["descending"] else ">"
+    if cursor:
+        # seek straight past the last page, like common/pagination.py
+        where.append(f"({', '.join(key)}) {comparison} ({', '.join('?' * len(key))})")
+        params += _parse_cursor(cursor, key)
+    direction = "DESC" if resource["descending"] else "ASC"
+    conn = get_db_connection()
+    # one more than we need, to see if there's another page
+    rows = conn.execute(
+        f"SELECT {', '.join(columns)} FROM {name} WHERE {' AND '.join(where)}"
+        f" ORDER BY {', '.join(f'{column} {direction}' for column in key)} LIMIT ?",
+        (*params, limit + 1),
+    ).fetchall()
+    conn.close()
+    following = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        following = ",".join(str(rows[-1][columns.index(column)]) for column in key)
+    return _respond({name: [_build(row, plan) for row in rows], "next": following})
+
+
+def _one(name: str, row_id: int):
+    columns, plan = _plan(RESOURCES[name])
+    conn = get_db_connection()
+    row = conn.execute(
+        f"SELECT {', '.join(columns)} FROM {name} WHERE id = ?", (row_id,)
+    ).fetchone()
+    conn.close()
+    if row is None:
+        abort(404, "that doesn't exist")
+    return _respond(_build(row, plan))
+
+
+@bp.route("/comics")
+def comics():
+    return _list("comics")
+
+
+@bp.route("/comics/<int:comic_id>")
+def comic(comic_id: int):
+    return _one("comics", comic_id)
+
+
+@bp.route("/artists")
+def artists():
+    return _list("artists")
+
+
+@bp.route("/artists/<int:artist_id>")
+def artist(artist_id: int):
+    return _one("artists", artist_id)
+
+
+@bp.route("/series")
+def series_list():
+    return _list("series")
+
+
+@bp.route("/series/<int:series_id>")
+def series(series_id: int):
+    return _one("series", series_id)
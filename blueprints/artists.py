@@ -1,93 +1,70 @@
-from flask import Blueprint, current_app, render_template, request, make_response
+from flask import Blueprint, abort, render_template
 from common.auth import check_token
 from common.artist import Artist
 from common.db import get_db_connection
-import mimetypes
+from common.feeds import feed_response
+from common.lookups import series_names
+from common.pagecache import cached_page, tag_page
+from common.pagination import paginate_comics
 
 bp = Blueprint("artists", __name__, url_prefix="/artists")
 
 
 @bp.route("/")
-@check_token(current_app)
+@check_token()
+@cached_page
 def list(login_artist: Artist | None):
     conn = get_db_connection()
     artists = conn.execute("SELECT username FROM artists").fetchall()
     conn.close()
+    tag_page("artists")
     return render_template("artists.jinja", artists=artists, login_artist=login_artist)
 
 
 @bp.route("/<string:artist>")
-@check_token(current_app)
+@check_token()
+@cached_page
 def artist(login_artist, artist):
     conn = get_db_connection()
-    page = request.args.get("page", type=int)
-    if page is None:
-        page = 0
-    else:
-        page -= 1
-    offset = page * 50
     artist_id = conn.execute(
         "SELECT id FROM artists WHERE username = ?", (artist,)
     ).fetchone()
-    comics = conn.execute(
-        "SELECT * FROM comics WHERE artistid = ? ORDER BY created DESC LIMIT 51 OFFSET ?",
-        (artist_id[0], offset),
-    ).fetchall()
-    series_db = conn.execute("SELECT id, name FROM series").fetchall()
-    seriesdict = {}
-    # convert the series to a dict for easy searching
-    for series in series_db:
-        seriesdict.update({series[0]: series[1]})
+    page = paginate_comics(conn, "artistid = ?", (artist_id[0],))
+    tag_page(f"artist:{artist_id[0]}")
+    seriesdict = series_names()
     conn.close()
-    # if there are more comics, allow going to the next page
-    # and clean up the extra comic
-    if len(comics) > 50:
-        comics.pop()
-        allownext = True
-    else:
-        # if not, do not allow going to the next page
-        allownext = False
     return render_template(
         "artist.jinja",
         artist=artist,
-        comics=comics,
-        page=page + 1,
-        allownext=allownext,
+        comics=page.comics,
+        newer=page.newer,
+        older=page.older,
         series=seriesdict,
         login_artist=login_artist,
     )
 
 
 @bp.route("/<string:artist>/feed")
-def feed(artist):
+def feed(artist, page: int | None = None):
     conn = get_db_connection()
     artist_id = conn.execute(
         "SELECT id FROM artists WHERE username = ?", (artist,)
     ).fetchone()
-    comics = conn.execute(
-        "SELECT * FROM comics WHERE artistid = ? ORDER BY created DESC",
-        (artist_id[0],),
-    ).fetchall()
-    series_db = conn.execute("SELECT id, name FROM series").fetchall()
-    seriesdict = {}
-    # convert the series to a dict for easy searching
-    for series in series_db:
-        seriesdict.update({series[0]: series[1]})
-    artists = conn.execute("SELECT id, username FROM artists").fetchall()
-    # convert the artist to a dict for easy searching
-    artistdict = {}
-    for other_artist in artists:
-        artistdict.update({other_artist[0]: other_artist[1]})
     conn.close()
-    response = make_response(
-        render_template(
-            "rss/artist.jinja",
-            artist=artist,
-            comics=comics,
-            series=seriesdict,
-            artists=artistdict,
-            types_map=mimetypes.types_map,
-        )
+    if artist_id is None:
+        abort(404)
+    return feed_response(
+        ("artist", artist_id[0]),
+        "artistid = ?",
+        (artist_id[0],),
+        "rss/artist.jinja",
+        ("artists.feed", "artists.feed_archive"),
+        {"artist": artist},
+        page,
+        artist=artist,
     )
-    response.headers["Content-Type"] = "application/xml"
-    return response
+
+
+@bp.route("/<string:artist>/feed/archive/<int:page>")
+def feed_archive(artist, page: int):
+    return feed(artist, page)
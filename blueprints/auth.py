@@ -11,21 +11,23 @@ from flask import (
 )
 from common.auth import check_token
 from common.artist import Artist
+from common.auth import evict_artist
 from common.db import get_db_connection
+from common.passwords import hash_password, verify_password
+from common import lookups, pagecache
 from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 
 @bp.route("/testauth")
-@check_token(current_app, required=True)
+@check_token(required=True)
 def testauth(artist):
     return f"artist: {artist[2]}"
 
 
 @bp.route("/create_account", methods=("GET", "POST"))
-@check_token(current_app)
+@check_token()
 def create_account(login_artist: Artist):
     if request.method == "POST":
         code = request.form["code"]
@@ -42,7 +44,7 @@ def create_account(login_artist: Artist):
                 "SELECT expired FROM codes WHERE code = ?", (request.form["code"],)
             ).fetchone()[0]
             if expired == False:
-                passhash = generate_password_hash(request.form["password"])
+                passhash = hash_password(request.form["password"])
                 conn.execute(
                     "INSERT INTO artists (username, passhash, isadmin) VALUES (?, ?, ?)",
                     (request.form["username"], passhash, False),
@@ -55,6 +57,8 @@ def create_account(login_artist: Artist):
                 return redirect(url_for("index"))
             conn.commit()
             conn.close()
+            lookups.invalidate_artists()
+            pagecache.purge("artists")
             flash("Account created!")
             resp = make_response(redirect(url_for("index")))
             resp.set_cookie("token", "")
@@ -64,7 +68,7 @@ def create_account(login_artist: Artist):
 
 
 @bp.route("/login", methods=["GET", "POST"])
-@check_token(current_app)
+@check_token()
 def login(login_artist: Artist | None):
     if request.method == "GET":
         return render_template("login.jinja", login_artist=login_artist)
@@ -78,9 +82,17 @@ def login(login_artist: Artist | None):
     if artist is None:
         flash("Invalid username or password!")
         return redirect("login")
-    if check_password_hash(artist[0], request.form["password"]) == False:
+    valid, newhash = verify_password(artist[0], request.form["password"])
+    if valid == False:
         flash("Invalid username or password!")
         return redirect("login")
+    if newhash is not None:
+        conn.execute(
+            "UPDATE artists SET passhash = ? WHERE id = ?", (newhash, artist[1])
+        )
+        conn.commit()
+        evict_artist(artist[1])
+    conn.close()
 
     # if we made it this far, the username and password is valid!
     token = jwt.encode(
@@ -1,7 +1,8 @@
-import os
+from urllib.parse import urlsplit
+
 from flask import (
     Blueprint,
-    current_app,
+    abort,
     render_template,
     request,
     flash,
@@ -12,88 +13,100 @@ from common.auth import check_token
 from common.artist import Artist
 from common.db import get_db_connection
 from common.db import get_comic
+from common.feeds import invalidate_feeds
+from common import pagecache, storage
+from common.pagecache import cached_page, tag_page
 
 bp = Blueprint("comics", __name__, url_prefix="/comics")
 
 
-@bp.route("/<int:comic_id>")
-@check_token(current_app)
-def comic(login_artist: Artist, comic_id):
-    comic = get_comic(comic_id)
-    conn = get_db_connection()
-    artist = conn.execute(
-        "SELECT username FROM artists WHERE id = ?", (comic[4],)
-    ).fetchone()
-    if comic["seriesid"]:
-        series = conn.execute(
-            "SELECT name FROM series WHERE id = ?", (comic["seriesid"],)
-        ).fetchone()[0]
-    else:
-        series = None
+# which comics "Previous Comic" and "Next Comic" walk through, depending on
+# where the reader came from. n is the neighbour and c is the current comic
+CONTEXTS = {
+    "index": "1",
+    "artists": "n.artistid = (SELECT artistid FROM c)",
+    "series": "n.seriesid = (SELECT seriesid FROM c)",
+}
+
+
+def _reader_query(context: str | None) -> str:
+    # the comic, its artist and series names, and its neighbours in the same
+    # (created, id) order the listings use, all in one go. Rows come back
+    # with position 0 for the comic, and -1 and 1 for the neighbours
+    query = """
+        WITH c AS (SELECT * FROM comics WHERE id = ?)
+        SELECT 0 AS position, c.*, a.username AS artistname, s.name AS seriesname
+        FROM c LEFT JOIN artists a ON a.id = c.artistid
+        LEFT JOIN series s ON s.id = c.seriesid
+    """
+    if context is not None:
+        query += f"""
+            UNION ALL SELECT * FROM (
+                SELECT 1, n.*, NULL, NULL FROM comics n
+                WHERE {CONTEXTS[context]}
+                AND (n.created, n.id) > (SELECT created, id FROM c)
+                ORDER BY n.created, n.id LIMIT 1
+            )
+            UNION ALL SELECT * FROM (
+                SELECT -1, n.*, NULL, NULL FROM comics n
+                WHERE {CONTEXTS[context]}
+                AND (n.created, n.id) < (SELECT created, id FROM c)
+                ORDER BY n.created DESC, n.id DESC LIMIT 1
+            )
+        """
+    return query
+
 
-    # find the next comic ID depending on the previous page
+def navigation_context() -> str | None:
+    # find the navigation context depending on the previous page
     if request.args.get("via", default=None) is not None:
         referrer = request.args.get("via")
-    else:
-        if request.referrer:
-            referrer = request.referrer.split("/")[3]
-        else:
-            referrer = None
-    match referrer:
-        case "series":
-            nextcomic = conn.execute(
-                "SELECT id FROM comics WHERE seriesid = ? AND id > ? LIMIT 1",
-                (comic["seriesid"], comic["id"]),
-            ).fetchone()
-            previouscomic = conn.execute(
-                "SELECT id FROM comics WHERE seriesid = ? AND id < ? ORDER BY id DESC LIMIT 1",
-                (comic["seriesid"], comic["id"]),
-            ).fetchone()
-        case "artists":
-            nextcomic = conn.execute(
-                "SELECT id FROM comics WHERE artistid = ? AND id > ? LIMIT 1",
-                (comic["artistid"], comic["id"]),
-            ).fetchone()
-            previouscomic = conn.execute(
-                "SELECT id FROM comics WHERE artistid = ? AND id < ? ORDER BY id DESC LIMIT 1",
-                (comic["artistid"], comic["id"]),
-            ).fetchone()
-        case _ if referrer is not None and (
-            referrer.startswith("?") or referrer == "index" or referrer == ""
-        ):
-            nextcomic = conn.execute(
-                "SELECT id FROM comics WHERE id > ? LIMIT 1",
-                (comic["id"],),
-            ).fetchone()
-            previouscomic = conn.execute(
-                "SELECT id FROM comics WHERE id < ? ORDER BY id DESC LIMIT 1",
-                (comic["id"],),
-            ).fetchone()
+    elif request.referrer:
+        referrer = urlsplit(request.referrer).path.split("/")[1]
+        if referrer == "":
             referrer = "index"
-        case _:
-            nextcomic = None
-            previouscomic = None
+    else:
+        referrer = None
+    if referrer not in CONTEXTS:
+        referrer = None
+    return referrer
 
-    if nextcomic is not None:
-        nextcomic = nextcomic[0]
 
-    if previouscomic is not None:
-        previouscomic = previouscomic[0]
+@bp.route("/<int:comic_id>")
+@check_token()
+@cached_page(vary=navigation_context)
+def comic(login_artist: Artist, comic_id):
+    referrer = navigation_context()
+    conn = get_db_connection()
+    rows = {
+        row["position"]: row
+        for row in conn.execute(_reader_query(referrer), (comic_id,)).fetchall()
+    }
+    conn.close()
+    if 0 not in rows:
+        abort(404)
+    comic = rows[0]
+    tag_page(f"comic:{comic_id}", f"artist:{comic['artistid']}")
+    if comic["seriesid"] is not None:
+        tag_page(f"series:{comic['seriesid']}")
+    if referrer == "index":
+        # any new comic could become the next one
+        tag_page("index")
 
     return render_template(
         "comic.jinja",
         comic=comic,
-        artist=artist[0],
-        series=series,
-        nextcomic=nextcomic,
-        previouscomic=previouscomic,
+        artist=comic["artistname"],
+        series=comic["seriesname"],
+        nextcomic=rows.get(1),
+        previouscomic=rows.get(-1),
         referrer=referrer,
         login_artist=login_artist,
     )
 
 
 @bp.route("/<int:id>/edit", methods=("GET", "POST"))
-@check_token(current_app, required=True)
+@check_token(required=True)
 def edit(login_artist: Artist, id):
     comic = get_comic(id)
     if request.method == "POST":
@@ -118,10 +131,16 @@ def edit(login_artist: Artist, id):
                     )
                 else:
                     # this comic is not in a series
+                    seriesid = None
                     conn.execute(
                         "UPDATE comics SET (title, seriesid) = (?, ?)" " WHERE id = ?",
                         (title, None, id),
                     )
+                conn.commit()
+                invalidate_feeds(artistid, comic["seriesid"], seriesid)
+                pagecache.purge_comics(
+                    artistid, comic["seriesid"], seriesid, comic_id=id
+                )
             else:
                 flash("You can't edit other people's comics!")
             conn.commit()
@@ -137,7 +156,7 @@ def edit(login_artist: Artist, id):
 
 
 @bp.route("/<int:id>/delete", methods=("POST",))
-@check_token(current_app, required=True)
+@check_token(required=True)
 def delete(login_artist: Artist, id):
     comic = get_comic(id)
     conn = get_db_connection()
@@ -145,11 +164,12 @@ def delete(login_artist: Artist, id):
         "SELECT artistid FROM comics WHERE id = ?", (id,)
     ).fetchone()[0]
     if login_artist.id == artistid or login_artist.isadmin:
-        fileext = conn.execute(
-            "SELECT fileext FROM comics WHERE id = ?", (id,)
-        ).fetchone()[0]
-        os.remove(f"static/comics/{id}.{fileext}")
         conn.execute("DELETE FROM comics WHERE id = ?", (id,))
+        conn.commit()
+        # the image might still be used by another comic
+        storage.release(conn, comic)
+        invalidate_feeds(artistid, comic["seriesid"])
+        pagecache.purge_comics(artistid, comic["seriesid"], comic_id=id)
     else:
         flash("You can't delete other people's comics!")
         return redirect(url_for("index"))
@@ -1,5 +1,3 @@
-import os
-import requests
 from flask import (
     Blueprint,
     current_app,
@@ -10,23 +8,30 @@ from flask import (
     url_for,
 )
 from common.auth import check_token
+from common.bulk import import_comics
 from common.artist import Artist
 from common.db import get_db_connection
-from werkzeug.utils import secure_filename
+from common.feeds import invalidate_feeds
+from common.images import queue_renditions
+from common import pagecache
+from common import storage
+from common import webhooks
+from common import lookups
 
 bp = Blueprint("create", __name__, url_prefix="/create")
 
 
-def allowed_file(filename):
-    return (
-        "." in filename
-        and filename.rsplit(".", 1)[1].lower()
-        in current_app.config["ALLOWED_EXTENSIONS"]
-    )
+def allowed_file(file):
+    """Return the format of an uploaded image, or None if it isn't allowed."""
+    # the extension is whatever the uploader named it, so look at the contents
+    fileext = storage.sniff(file.stream)
+    if fileext not in current_app.config["ALLOWED_EXTENSIONS"]:
+        return None
+    return fileext
 
 
 @bp.route("/comic", methods=("GET", "POST"))
-@check_token(current_app, required=True)
+@check_token(required=True)
 def comic(login_artist: Artist):
     if request.method == "POST":
         conn = get_db_connection()
@@ -42,7 +47,8 @@ def comic(login_artist: Artist):
             flash("No selected file")
             return redirect(request.url)
 
-        if file and allowed_file(file.filename):
+        fileext = allowed_file(file)
+        if fileext is not None:
             if not title:
                 flash("Title is required!")
                 return redirect(request.url)
@@ -68,38 +74,39 @@ def comic(login_artist: Artist):
                     ).fetchone()[0]
                 else:
                     seriesid = None
-                cur.execute(
-                    "INSERT INTO comics (title, fileext, artistid, seriesid) VALUES (?, ?, ?, ?)",
-                    (title, secure_filename(file.filename.split(".")[-1]), login_artist.id, seriesid),  # type: ignore
-                )
-                conn.commit()
-                filename = f"{cur.lastrowid}.{secure_filename(file.filename.split('.')[-1])}"  # type: ignore
-                file.save(os.path.join(current_app.config["UPLOAD_FOLDER"], filename))
-                cur.close()
-                conn.close()
-                webhookURL = os.getenv("DISCORD_WEBHOOK_URL")
-                print(webhookURL)
-                if webhookURL is not None:
-                    requests.post(
-                        webhookURL,
-                        json={
-                            "username": login_artist.username,
-                            "embeds": [
-                                {
-                                    "title": title,
-                                    "url": f"{current_app.config['SERVER_ADDRESS']}/{cur.lastrowid}",
-                                    "description": "Uploaded a new comic",
-                                    "image": {
-                                        "url": f"{current_app.config['SERVER_ADDRESS']}/static/comics/{filename}"
-                                    },
-                                }
-                            ],
+                with storage.lock:
+                    filehash = storage.store(file, fileext)
+                    cur.execute(
+                        "INSERT INTO comics (title, fileext, artistid, seriesid, filehash) VALUES (?, ?, ?, ?, ?)",
+                        (title, fileext, login_artist.id, seriesid, filehash),
+                    )
+                    imageurl = storage.image_url(
+                        {"filehash": filehash, "fileext": fileext}
+                    )
+                    webhooks.enqueue(
+                        conn,
+                        current_app.config,
+                        login_artist.username,
+                        {
+                            "title": title,
+                            "url": f"{current_app.config['SERVER_ADDRESS']}/comics/{cur.lastrowid}",
+                            "description": "Uploaded a new comic",
+                            "image": {
+                                "url": f"{current_app.config['SERVER_ADDRESS']}{imageurl}"
+                            },
                         },
                     )
+                    conn.commit()
+                webhooks.notify()
+                invalidate_feeds(login_artist.id, seriesid)
+                pagecache.purge_comics(login_artist.id, seriesid)
+                queue_renditions(conn, cur.lastrowid)
+                cur.close()
+                conn.close()
                 return redirect(url_for("index"))
         else:
             flash(
-                "You either did not attach a file, or the file extension was not allowed."
+                "You either did not attach a file, or it isn't a png, jpeg, gif, tiff or webp image."
             )
             return redirect(request.url)
     else:
@@ -110,8 +117,31 @@ def comic(login_artist: Artist):
         return render_template("create.jinja", series=series, login_artist=login_artist)
 
 
+@bp.route("/bulk", methods=("GET", "POST"))
+@check_token(required=True)
+def bulk(login_artist: Artist):
+    if request.method == "POST":
+        # a whole back catalogue is a lot bigger than one comic
+        request.max_content_length = current_app.config["MAX_BULK_LENGTH"]
+        file = request.files.get("archive")
+        if file is None or file.filename == "":
+            flash("No selected file")
+            return redirect(request.url)
+        conn = get_db_connection()
+        ids, problems = import_comics(conn, login_artist, file.stream)
+        conn.close()
+        if problems:
+            for problem in problems:
+                flash(problem)
+            return redirect(request.url)
+        flash(f"Uploaded {len(ids)} comics!")
+        return redirect(url_for("artists.artist", artist=login_artist.username))
+    else:
+        return render_template("create_bulk.jinja", login_artist=login_artist)
+
+
 @bp.route("/series", methods=("GET", "POST"))
-@check_token(current_app)
+@check_token()
 def series(login_artist: Artist):
     if request.method == "POST":
         conn = get_db_connection()
@@ -128,6 +158,8 @@ def series(login_artist: Artist):
         )
         conn.commit()
         conn.close()
+        lookups.invalidate_series()
+        pagecache.purge("series")
         flash("Series created! You can now publish comics to it!")
         return redirect("/")
     else:
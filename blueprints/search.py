@@ -0,0 +1,35 @@
+from flask import Blueprint, render_template, request
+from common.auth import check_token
+from common.artist import Artist
+from common.db import get_db_connection
+from common.lookups import artist_names, series_names
+from common.search import match_expression, search_comics, search_names
+
+bp = Blueprint("search", __name__, url_prefix="/search")
+
+
+@bp.route("/")
+@check_token()
+def search(login_artist: Artist | None):
+    query = request.args.get("q", "")
+    page = max(request.args.get("page", 1, type=int), 1)
+    comics, hasmore, artists, series = [], False, [], []
+    expression = match_expression(query)
+    if expression is not None:
+        conn = get_db_connection()
+        comics, hasmore = search_comics(conn, expression, page)
+        if page == 1:
+            artists, series = search_names(conn, expression)
+        conn.close()
+    return render_template(
+        "search.jinja",
+        query=query,
+        page=page,
+        hasmore=hasmore,
+        comics=comics,
+        matching_artists=artists,
+        matching_series=series,
+        artists=artist_names(),
+        series=series_names(),
+        login_artist=login_artist,
+    )
@@ -1,10 +1,8 @@
-import mimetypes
 from flask import (
     Blueprint,
-    current_app,
     render_template,
     request,
-    make_response,
+    abort,
     flash,
     redirect,
     url_for,
@@ -12,31 +10,34 @@ from flask import (
 from common.auth import check_token
 from common.artist import Artist
 from common.db import get_db_connection
+from common import lookups, pagecache
+from common.feeds import feed_response, invalidate_all_feeds
+from common.lookups import artist_names
+from common.sitemap import invalidate_shard
+from common.pagecache import cached_page, tag_page
+from common.pagination import paginate_comics
 
 bp = Blueprint("series", __name__, url_prefix="/series")
 
 
 @bp.route("/")
-@check_token(current_app)
+@check_token()
+@cached_page
 def list(login_artist: Artist | None):
     conn = get_db_connection()
     series = conn.execute("SELECT * FROM series").fetchall()
     conn.close()
+    tag_page("series")
     return render_template(
         "series_list.jinja", series_list=series, login_artist=login_artist
     )
 
 
 @bp.route("/<string:seriesName>")
-@check_token(current_app)
+@check_token()
+@cached_page
 def series(login_artist: Artist | None, seriesName: str):
     conn = get_db_connection()
-    page = request.args.get("page", type=int)
-    if page is None:
-        page = 0
-    else:
-        page -= 1
-    offset = page * 50
     seriesID = conn.execute(
         "SELECT id FROM series WHERE name = ?", (seriesName,)
     ).fetchone()
@@ -44,72 +45,49 @@ def series(login_artist: Artist | None, seriesName: str):
         flash("Invaid Series!")
         return redirect("/series")
     seriesID = seriesID[0]
-    comics = conn.execute(
-        "SELECT * FROM comics WHERE seriesid = ? ORDER BY created DESC LIMIT 51 OFFSET ?",
-        (seriesID, offset),
-    ).fetchall()
-    artists = conn.execute("SELECT id, username FROM artists").fetchall()
-    # convert the artist to a dict for easy searching
-    artistdict = {}
-    for other_artist in artists:
-        artistdict.update({other_artist[0]: other_artist[1]})
+    tag_page(f"series:{seriesID}")
+    page = paginate_comics(conn, "seriesid = ?", (seriesID,))
+    artistdict = artist_names()
     conn.close()
-    # if there are more comics, allow going to the next page
-    # and clean up the extra comic
-    if len(comics) > 50:
-        comics.pop()
-        allownext = True
-    else:
-        # if not, do not allow going to the next page
-        allownext = False
     return render_template(
         "series.jinja",
         seriesName=seriesName,
-        comics=comics,
-        page=page + 1,
-        allownext=allownext,
+        comics=page.comics,
+        newer=page.newer,
+        older=page.older,
         login_artist=login_artist,
         artists=artistdict,
     )
 
 
 @bp.route("/<string:seriesName>/feed")
-def feed(seriesName):
+def feed(seriesName, page: int | None = None):
     conn = get_db_connection()
     series_id = conn.execute(
         "SELECT id FROM series WHERE name = ?", (seriesName,)
     ).fetchone()
-    comics = conn.execute(
-        "SELECT * FROM comics WHERE seriesid = ? ORDER BY created DESC",
-        (series_id[0],),
-    ).fetchall()
-    artists = conn.execute("SELECT id, username FROM artists").fetchall()
-    # convert the artist to a dict for easy searching
-    artistdict = {}
-    for other_artist in artists:
-        artistdict.update({other_artist[0]: other_artist[1]})
-    series_db = conn.execute("SELECT id, name FROM series").fetchall()
-    seriesdict = {}
-    # convert the series to a dict for easy searching
-    for series in series_db:
-        seriesdict.update({series[0]: series[1]})
     conn.close()
-    response = make_response(
-        render_template(
-            "rss/series.jinja",
-            comics=comics,
-            seriesName=seriesName,
-            artists=artistdict,
-            series=seriesdict,
-            types_map=mimetypes.types_map,
-        )
+    if series_id is None:
+        abort(404)
+    return feed_response(
+        ("series", series_id[0]),
+        "seriesid = ?",
+        (series_id[0],),
+        "rss/series.jinja",
+        ("series.feed", "series.feed_archive"),
+        {"seriesName": seriesName},
+        page,
+        seriesName=seriesName,
     )
-    response.headers["Content-Type"] = "application/xml"
-    return response
+
+
+@bp.route("/<string:seriesName>/feed/archive/<int:page>")
+def feed_archive(seriesName, page: int):
+    return feed(seriesName, page)
 
 
 @bp.route("/<string:SeriesName>/edit", methods=("GET", "POST"))
-@check_token(current_app, required=True)
+@check_token(required=True)
 def edit(login_artist: Artist, SeriesName):
     if request.method == "POST":
         conn = get_db_connection()
@@ -120,9 +98,9 @@ def edit(login_artist: Artist, SeriesName):
             # there is already a series with this name
             flash("There is already a series with this name!")
             return redirect("/edit_series")
-        artistid = conn.execute(
-            "SELECT artistid FROM series WHERE name = ?", (SeriesName,)
-        ).fetchone()[0]
+        seriesid, artistid = conn.execute(
+            "SELECT id, artistid FROM series WHERE name = ?", (SeriesName,)
+        ).fetchone()
         if artistid == login_artist.id or login_artist.isadmin:
             conn.execute(
                 "UPDATE series SET (name) = (?) WHERE name = ?",
@@ -134,6 +112,10 @@ def edit(login_artist: Artist, SeriesName):
 
         conn.commit()
         conn.close()
+        lookups.invalidate_series()
+        invalidate_all_feeds()
+        pagecache.purge_all()
+        invalidate_shard("series", seriesid)
         flash("Series updated!")
         return redirect(f"/series")
     else:
@@ -143,7 +125,7 @@ def edit(login_artist: Artist, SeriesName):
 
 
 @bp.route("/<string:SeriesName>/delete", methods=("POST",))
-@check_token(current_app, required=True)
+@check_token(required=True)
 def delete(login_artist: Artist, SeriesName):
     conn = get_db_connection()
     artistid = conn.execute(
@@ -156,5 +138,8 @@ def delete(login_artist: Artist, SeriesName):
         return redirect(url_for("index"))
     conn.commit()
     conn.close()
+    lookups.invalidate_series()
+    invalidate_all_feeds()
+    pagecache.purge_all()
     flash("Series deleted!")
     return redirect(url_for("index"))
@@ -1,61 +1,128 @@
 from functools import wraps
 
-from flask import flash, make_response, redirect, request
+from flask import current_app, flash, make_response, redirect, request
 import jwt
+from common.cache import LRUCache, PerDatabase
 from common.db import get_db_connection
 from common.artist import Artist
+from common.metrics import count_auth
+from common import profiling
+
+# logged in artists, by id. This is shared between every waitress thread,
+# so anything that changes an artist (like locking them) must evict them!
+artist_caches = PerDatabase(
+    lambda config: LRUCache(
+        maxsize=config.get("ARTIST_CACHE_SIZE", 1024),
+        ttl=config.get("ARTIST_CACHE_TTL", 60),
+    )
+)
+
+
+def init_app(app):
+    artist_caches.get(app.config)
+
+
+def get_artist(artist_id: int) -> Artist | None:
+    artist_cache = artist_caches.get()
+    artist = artist_cache.get(artist_id)
+    if artist is None:
+        conn = get_db_connection()
+        row = conn.execute(
+            "SELECT * FROM artists WHERE id = ?", (artist_id,)
+        ).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        artist = Artist(row)
+        artist_cache.set(artist_id, artist)
+    return artist
+
+
+def evict_artist(artist_id: int):
+    artist_caches.get().pop(artist_id)
+
+
+def _profiling_admin() -> bool:
+    """Whether the token belongs to an admin, before profiling them."""
+    token = request.cookies.get("token")
+    if not token:
+        return False
+    try:
+        data = jwt.decode(token, current_app.config["SECRET_KEY"], algorithms=["HS256"])
+    except jwt.exceptions.PyJWTError:
+        return False
+    artist = get_artist(data["id"])
+    return artist is not None and artist.isadmin and not artist.islocked
 
 
 # decorator for verifying the JWT
-def check_token(app, required: bool = False, adminrequired: bool = False):
+def check_token(*, required: bool = False, adminrequired: bool = False):
     def _check_token(f):
         @wraps(f)
         def decorated(*args, **kwargs):
+            # anyone can ask, so only profile an admin's requests; profiling
+            # slows a request down a lot
+            if profiling.requested() and _profiling_admin():
+                # profiled from here, so decoding the token is included too
+                return profiling.run(checked, *args, **kwargs)
+            return checked(*args, **kwargs)
+
+        def checked(*args, **kwargs):
             token = None
             # jwt is passed in the request header
             if "token" in request.cookies:
                 token = request.cookies["token"]
             # return 401 if token is not passed
             if not token:
+                count_auth("anonymous")
                 if required:
                     flash("You must be logged in to do that!")
                     return redirect("/login")
                 else:
                     return f(None, *args, **kwargs)
-            conn = get_db_connection()
             try:
                 # decoding the payload to fetch the stored details
-                data = jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
-                artist = conn.execute(
-                    "SELECT * FROM artists WHERE id = ?", (data["id"],)
-                ).fetchone()
-                if Artist(artist).islocked:
-                    flash(
-                        "Your account has been locked. Please contact AnnoyingRains for assistance."
-                    )
-                    resp = make_response(redirect("/"))
-                    resp.delete_cookie("token")
-                    return resp
-                if adminrequired:
-                    if Artist(artist).isadmin == False:
-                        flash("Only adminstrators can access that page.")
-                        return redirect("/")
+                data = jwt.decode(
+                    token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
+                )
             except jwt.exceptions.ExpiredSignatureError as e:
+                count_auth("expired")
                 if required:
                     flash("Your login has expired! Please log in again")
                     return redirect("/login")
                 else:
                     return f(None, *args, **kwargs)
             except jwt.exceptions.PyJWTError:
+                count_auth("invalid")
+                if required:
+                    flash("You have an invalid token! Please log in again")
+                    return redirect("/login")
+                else:
+                    return f(None, *args, **kwargs)
+            artist = get_artist(data["id"])
+            if artist is None:
+                # the artist this token was for has been deleted
+                count_auth("deleted")
                 if required:
                     flash("You have an invalid token! Please log in again")
                     return redirect("/login")
                 else:
                     return f(None, *args, **kwargs)
+            if artist.islocked:
+                count_auth("locked")
+                flash(
+                    "Your account has been locked. Please contact AnnoyingRains for assistance."
+                )
+                resp = make_response(redirect("/"))
+                resp.delete_cookie("token")
+                return resp
+            if adminrequired:
+                if artist.isadmin == False:
+                    count_auth("not_admin")
+                    flash("Only adminstrators can access that page.")
+                    return redirect("/")
+            count_auth("ok")
             # returns the current logged in users context to the routes
-            if artist is not None:
-                # convert the artist into an artist object
-                artist = Artist(artist)
             return f(artist, *args, **kwargs)
 
         return decorated
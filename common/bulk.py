@@ -0,0 +1,190 @@
+import csv
+import hashlib
+import io
+import os
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, url_for
+from PIL import Image
+
+from common import pagecache, storage, webhooks
+from common.artist import Artist
+from common.feeds import invalidate_feeds
+from common.images import queue_renditions
+
+# a bulk import is a zip file or folder of images, with a manifest.csv
+# naming each one:
+#
+#   file,title,series
+#   page1.png,The first page,My series
+#   page2.png,The second page,
+#
+# every image is checked before anything is published, and the comics
+# are either all added in one transaction or none of them are
+MANIFEST = "manifest.csv"
+
+
+class Source:
+    """The files of a bulk import, from either a zip file or a folder."""
+
+    def __init__(self, source):
+        if isinstance(source, str) and os.path.isdir(source):
+            self.folder = source
+            self.zip = None
+        else:
+            self.folder = None
+            self.zip = zipfile.ZipFile(source)
+
+    def size(self, name: str) -> int:
+        if self.zip is not None:
+            return self.zip.getinfo(name).file_size
+        return os.path.getsize(self._path(name))
+
+    def open(self, name: str):
+        if self.zip is not None:
+            return self.zip.open(name)
+        return open(self._path(name), "rb")
+
+    def _path(self, name: str) -> str:
+        path = os.path.realpath(os.path.join(self.folder, name))
+        # only files directly inside the folder
+        folder = os.path.realpath(self.folder)
+        if os.path.dirname(path) != folder or not os.path.isfile(path):
+            raise KeyError(name)
+        return path
+
+
+def _read_manifest(source: Source) -> list[dict]:
+    with source.open(MANIFEST) as f:
+        return list(csv.DictReader(io.TextIOWrapper(f, encoding="utf-8-sig")))
+
+
+def _prepare(source: Source, name: str, folder: str, limit: int):
+    """Copy one image to a temporary file, returning (path, hash, extension)."""
+    if source.size(name) > limit:
+        raise ValueError("it is too big")
+    os.makedirs(os.path.join(folder, "tmp"), exist_ok=True)
+    tmp = os.path.join(folder, "tmp", uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    try:
+        with source.open(name) as f, open(tmp, "wb+") as out:
+            while chunk := f.read(storage.CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+            out.seek(0)
+            fileext = storage.sniff(out)
+            if fileext is None:
+                raise ValueError("it isn't a png, jpeg, gif, tiff or webp image")
+            with Image.open(out) as image:
+                image.verify()
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp, digest.hexdigest(), fileext
+
+
+def import_comics(conn, artist: Artist, source) -> tuple[list[int], list[str]]:
+    """Add every comic in a bulk import for `artist`.
+
+    Returns the ids of the new comics, or the problems that stopped the
+    import (in which case nothing was added).
+    """
+    config = current_app.config
+    try:
+        source = Source(source)
+    except zipfile.BadZipFile:
+        return [], ["That isn't a zip file!"]
+    try:
+        entries = _read_manifest(source)
+    except KeyError:
+        return [], [f"There is no {MANIFEST}!"]
+    except (ValueError, csv.Error) as e:
+        return [], [f"{MANIFEST} couldn't be read: {e}"]
+    if not entries:
+        return [], [f"{MANIFEST} doesn't list any comics!"]
+
+    problems = []
+    series = {
+        row["name"]: (row["id"], row["artistid"])
+        for row in conn.execute("SELECT id, name, artistid FROM series")
+    }
+    for line, entry in enumerate(entries, start=2):
+        if not (entry.get("file") or "").strip():
+            problems.append(f"line {line}: no file")
+        if not (entry.get("title") or "").strip():
+            problems.append(f"line {line}: a title is required")
+        seriesname = (entry.get("series") or "").strip()
+        if seriesname and seriesname not in series:
+            problems.append(f"line {line}: there is no series called {seriesname}")
+        elif seriesname and series[seriesname][1] not in (artist.id, None):
+            problems.append(f"line {line}: {seriesname} is someone else's series")
+    if problems:
+        return [], problems
+
+    # reading, hashing and checking the images is the slow part, do it in parallel
+    folder = config["UPLOAD_FOLDER"]
+    with ThreadPoolExecutor(max_workers=config["BULK_WORKERS"]) as pool:
+        futures = [
+            pool.submit(
+                _prepare,
+                source,
+                entry["file"].strip(),
+                folder,
+                config["MAX_CONTENT_LENGTH"],
+            )
+            for entry in entries
+        ]
+        prepared = []
+        for line, future in enumerate(futures, start=2):
+            try:
+                prepared.append(future.result())
+            except KeyError:
+                problems.append(f"line {line}: there is no file called that")
+            except Exception as e:
+                problems.append(f"line {line}: {e}")
+    if problems:
+        for tmp, _, _ in prepared:
+            os.remove(tmp)
+        return [], problems
+
+    ids = []
+    seriesids = set()
+    with storage.lock:
+        for tmp, filehash, fileext in prepared:
+            storage.place(tmp, filehash, fileext, folder)
+        for entry, (_, filehash, fileext) in zip(entries, prepared):
+            seriesname = (entry.get("series") or "").strip()
+            seriesid = series[seriesname][0] if seriesname else None
+            seriesids.add(seriesid)
+            cur = conn.execute(
+                "INSERT INTO comics (title, fileext, artistid, seriesid, filehash) VALUES (?, ?, ?, ?, ?)",
+                (entry["title"].strip(), fileext, artist.id, seriesid, filehash),
+            )
+            ids.append(cur.lastrowid)
+        # one notification for the lot, rather than one per comic
+        first = {"filehash": prepared[0][1], "fileext": prepared[0][2]}
+        webhooks.enqueue(
+            conn,
+            config,
+            artist.username,
+            {
+                "title": f"{len(ids)} new comics",
+                "url": config["SERVER_ADDRESS"]
+                + url_for("artists.artist", artist=artist.username),
+                "description": f"Uploaded {len(ids)} comics",
+                "image": {"url": config["SERVER_ADDRESS"] + storage.image_url(first)},
+            },
+        )
+        conn.commit()
+    webhooks.notify()
+    invalidate_feeds(artist.id, *seriesids)
+    pagecache.purge_comics(artist.id, *seriesids)
+    # comics sharing an image get their renditions together
+    queued = set()
+    for comic_id, (_, filehash, _) in zip(ids, prepared):
+        if filehash not in queued:
+            queued.add(filehash)
+            queue_renditions(conn, comic_id)
+    return ids, []
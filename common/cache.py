@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from common.db import database_path
+
+
+class LRUCache:
+    """A small thread-safe least-recently-used cache.
+
+    Entries older than `ttl` seconds are treated as missing, and once
+    there are more than `maxsize` entries the least recently used one is
+    thrown away. Hits and misses are counted so the cache can be checked
+    on in production.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                self.ttl is None or time.monotonic() - entry[0] < self.ttl
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                # expired
+                del self._entries[key]
+                self._removed(key, entry)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._removed(*self._entries.popitem(last=False))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._removed(key, entry)
+        return default if entry is None else entry[1]
+
+    def _removed(self, key, entry):
+        # called with the lock held whenever an entry is dropped
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+class TaggedCache(LRUCache):
+    """An LRUCache whose entries can be tagged, and thrown away by tag.
+
+    Every purge also bumps `generation`, so something that was worked out
+    while a purge happened can tell it may be stale and not store it.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        super().__init__(maxsize, ttl)
+        self.generation = 0
+        self._tags: dict = {}
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            if key in self._entries:
+                self._removed(key, self._entries.pop(key))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+        super().set(key, (tuple(tags), value))
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        return default if entry is None else entry[1]
+
+    def pop(self, key, default=None):
+        entry = super().pop(key)
+        return default if entry is None else entry[1]
+
+    def _removed(self, key, entry):
+        for tag in entry[1][0]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def purge(self, *tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    entry = self._entries.pop(key, None)
+                    if entry is not None:
+                        self._removed(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+
+class PerDatabase:
+    """One of something, like a cache, for each database.
+
+    Apps on different databases can share a process, so what they keep
+    about their data mustn't be shared. `factory` makes it from the
+    config the first time a database is seen, and get() finds it by the
+    DATABASE of `config`, or else of the current app.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._items: dict = {}
+
+    def get(self, config=None):
+        if config is None:
+            config = current_app.config if has_app_context() else {}
+        path = database_path(config)
+        with self._lock:
+            item = self._items.get(path)
+            if item is None:
+                item = self._items[path] = self.factory(config)
+            return item
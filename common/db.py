@@ -1,14 +1,160 @@
 import sqlite3
+import threading
+import time
 
-from flask import abort
+from flask import abort, current_app, g, has_app_context
 
+DEFAULTS = {
+    "DATABASE": "db/database.db",
+    "SQLITE_JOURNAL_MODE": "WAL",
+    "SQLITE_SYNCHRONOUS": "NORMAL",
+    # milliseconds to wait for another writer before giving up
+    "SQLITE_BUSY_TIMEOUT": 5000,
+    # bytes of the database file to memory map
+    "SQLITE_MMAP_SIZE": 256 * 1024 * 1024,
+    # negative values are in KiB, so this is a 64MiB page cache
+    "SQLITE_CACHE_SIZE": -64 * 1024,
+}
 
-def get_db_connection():
-    conn = sqlite3.connect("db/database.db")
+# sqlite connections can't be shared between threads, so every waitress
+# worker thread keeps its own connection open and reuses it between requests
+_local = threading.local()
+# called with every new connection, so tools like bench/run.py can watch
+# the queries it makes
+connection_hooks = []
+
+
+def _timed(method, *args, statements: int = 0):
+    started = time.perf_counter()
+    try:
+        return method(*args)
+    finally:
+        _local.queries = getattr(_local, "queries", 0) + statements
+        _local.query_time = (
+            getattr(_local, "query_time", 0.0) + time.perf_counter() - started
+        )
+
+
+class TimedCursor(sqlite3.Cursor):
+    # counts the statements each thread runs, and the time spent running
+    # them and fetching their rows, for common/metrics.py
+    def execute(self, sql, parameters=(), /):
+        return _timed(super().execute, sql, parameters, statements=1)
+
+    def executemany(self, sql, parameters, /):
+        return _timed(super().executemany, sql, parameters, statements=1)
+
+    def executescript(self, script, /):
+        return _timed(super().executescript, script, statements=1)
+
+    def fetchone(self):
+        return _timed(super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        return _timed(super().fetchmany, size)
+
+    def fetchall(self):
+        return _timed(super().fetchall)
+
+    def __next__(self):
+        return _timed(super().__next__)
+
+
+def query_stats() -> tuple[int, float]:
+    """The statements this thread has run, and the seconds they took."""
+    return getattr(_local, "queries", 0), getattr(_local, "query_time", 0.0)
+
+
+class PooledConnection(sqlite3.Connection):
+    # routes still call close() once they are done with the database,
+    # but the connection belongs to the thread, so only throw away
+    # anything that was left uncommitted
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # the shortcuts don't go through cursor(), so they wouldn't be timed
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters, /):
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, script, /):
+        return self.cursor().executescript(script)
+
+
+def _setting(config, key):
+    return config.get(key, DEFAULTS[key])
+
+
+def _connect(config) -> PooledConnection:
+    conn = sqlite3.connect(_setting(config, "DATABASE"), factory=PooledConnection)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA journal_mode = {_setting(config, 'SQLITE_JOURNAL_MODE')}")
+    conn.execute(f"PRAGMA synchronous = {_setting(config, 'SQLITE_SYNCHRONOUS')}")
+    conn.execute(
+        f"PRAGMA busy_timeout = {int(_setting(config, 'SQLITE_BUSY_TIMEOUT'))}"
+    )
+    conn.execute(f"PRAGMA mmap_size = {int(_setting(config, 'SQLITE_MMAP_SIZE'))}")
+    conn.execute(f"PRAGMA cache_size = {int(_setting(config, 'SQLITE_CACHE_SIZE'))}")
+    for hook in connection_hooks:
+        hook(conn)
+    return conn
+
+
+def database_path(config=None) -> str:
+    """The database of `config`, or else of the current app."""
+    if config is None:
+        config = current_app.config if has_app_context() else {}
+    return _setting(config, "DATABASE")
+
+
+def _thread_connection(config) -> PooledConnection:
+    if not hasattr(_local, "connections"):
+        _local.connections = {}
+    path = database_path(config)
+    conn = _local.connections.get(path)
+    if conn is None:
+        conn = _connect(config)
+        _local.connections[path] = conn
     return conn
 
 
+def get_db_connection(config=None) -> PooledConnection:
+    if config is None and has_app_context():
+        # hand out the same connection for the whole app context,
+        # so helpers like get_comic don't need one of their own
+        if "db" not in g:
+            g.db = _thread_connection(current_app.config)
+        return g.db
+    return _thread_connection(config if config is not None else {})
+
+
+def release_db_connection(exception=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+
+
+def close_thread_connections():
+    for conn in getattr(_local, "connections", {}).values():
+        conn.really_close()
+    _local.connections = {}
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db_connection)
+
+
 def get_comic(comic_id):
     conn = get_db_connection()
     comic = conn.execute("SELECT * FROM comics WHERE id = ?", (comic_id,)).fetchone()
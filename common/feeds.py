@@ -0,0 +1,272 @@
+import mimetypes
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import abort, current_app, request, stream_template, url_for
+from werkzeug.http import is_resource_modified
+
+from common.cache import LRUCache, PerDatabase
+from common.db import database_path, get_db_connection
+from common.lookups import artist_names, series_names
+
+# rendered feeds, keyed by scope, generation and page. A scope is one of
+# ("index",), ("artist", id) or ("series", id)
+feed_caches = PerDatabase(
+    lambda config: LRUCache(maxsize=1024, ttl=config.get("FEED_CACHE_TTL", 300))
+)
+
+# every invalidation bumps the scope's generation, which is part of both the
+# cache key and the ETag, so edits and deletes are noticed, not just new
+# comics. The generations start again from zero on restart, so tag them
+# with this process too
+_boot = os.urandom(4).hex()
+_lock = threading.Lock()
+# database -> scope -> generation, and database -> the global generation
+_generations: dict[str, dict[tuple, int]] = {}
+_global_generations: dict[str, int] = {}
+
+# archive page n is the comics with ids n * FEED_ARCHIVE_SIZE + 1 to
+# (n + 1) * FEED_ARCHIVE_SIZE, and is archived once every id in it has been
+# handed out. New comics always get new ids, so they never land on an
+# archived page and nothing shifts when a comic is deleted. Its comics can
+# still be edited or deleted though, so caches hold them for a day, not forever
+ARCHIVED = "public, max-age=86400"
+
+
+def init_app(app):
+    feed_caches.get(app.config)
+
+
+def _generation(scope: tuple, database: str) -> str:
+    with _lock:
+        generations = _generations.get(database, {})
+        return f"{_global_generations.get(database, 0)}.{generations.get(scope, 0)}"
+
+
+def invalidate_feeds(artistid: int | None = None, *seriesids: int | None):
+    """Throw away the global feed, and the feeds for an artist and series."""
+    scopes = [("index",)]
+    if artistid is not None:
+        scopes.append(("artist", artistid))
+    for seriesid in seriesids:
+        if seriesid is not None:
+            scopes.append(("series", seriesid))
+    with _lock:
+        generations = _generations.setdefault(database_path(), {})
+        for scope in scopes:
+            generations[scope] = generations.get(scope, 0) + 1
+
+
+def invalidate_all_feeds():
+    # for changes that show up in every feed, like renaming a series
+    database = database_path()
+    with _lock:
+        _global_generations[database] = _global_generations.get(database, 0) + 1
+    feed_caches.get().clear()
+
+
+def _page(comic_id: int, size: int) -> int:
+    return (comic_id - 1) // size
+
+
+def _stats(scope: tuple, generation: str, where: str, params: tuple, size: int):
+    conn = get_db_connection()
+    # comics are AUTOINCREMENT, so ids are never handed out twice
+    allocated = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'comics'"
+    ).fetchone()
+    pages = (allocated[0] if allocated is not None else 0) // size
+    key = (scope, generation, pages, "stats")
+    feed_cache = feed_caches.get()
+    stats = feed_cache.get(key)
+    if stats is None:
+        count, unarchived = conn.execute(
+            f"SELECT count(*), count(*) FILTER (WHERE id > ?) FROM comics"
+            f" WHERE {where}",
+            (pages * size, *params),
+        ).fetchone()
+        newest = conn.execute(
+            f"SELECT id, created FROM comics WHERE {where}"
+            " ORDER BY created DESC, id DESC LIMIT 1",
+            params,
+        ).fetchone()
+        last = conn.execute(
+            f"SELECT max(id) FROM comics WHERE {where} AND id <= ?",
+            (*params, pages * size),
+        ).fetchone()[0]
+        stats = (
+            count,
+            tuple(newest) if newest is not None else None,
+            pages,
+            unarchived,
+            _page(last, size) if last is not None else None,
+        )
+        feed_cache.set(key, stats)
+    return stats
+
+
+def _neighbours(
+    scope: tuple,
+    generation: str,
+    where: str,
+    params: tuple,
+    size: int,
+    pages: int,
+    archive: int,
+):
+    """The archive pages either side of `archive` that have comics in them,
+    skipping empty ranges, and whether `archive` has any itself."""
+    key = (scope, generation, pages, archive, "neighbours")
+    feed_cache = feed_caches.get()
+    neighbours = feed_cache.get(key)
+    if neighbours is None:
+        conn = get_db_connection()
+        first, last = archive * size, (archive + 1) * size
+        found = conn.execute(
+            f"SELECT 1 FROM comics WHERE {where} AND id > ? AND id <= ? LIMIT 1",
+            (*params, first, last),
+        ).fetchone()
+        previous = conn.execute(
+            f"SELECT max(id) FROM comics WHERE {where} AND id <= ?",
+            (*params, first),
+        ).fetchone()[0]
+        following = conn.execute(
+            f"SELECT min(id) FROM comics WHERE {where} AND id > ? AND id <= ?",
+            (*params, last, pages * size),
+        ).fetchone()[0]
+        neighbours = (
+            found is not None,
+            _page(previous, size) if previous is not None else None,
+            _page(following, size) if following is not None else None,
+        )
+        feed_cache.set(key, neighbours)
+    return neighbours
+
+
+def _respond(body, etag: str, last_modified, cache_control: str | None):
+    response = current_app.response_class(body, mimetype="application/xml")
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if cache_control is not None:
+        response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def _tee(chunks, database: str, scope: tuple, generation: str, key, headers, cache):
+    # keep a copy of what we stream out, so the next request can skip rendering
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    # don't keep it if it was invalidated while we were rendering
+    if _generation(scope, database) == generation:
+        cache.set(key, ("".join(parts), *headers))
+
+
+def feed_response(
+    scope: tuple,
+    where: str,
+    params: tuple,
+    template: str,
+    endpoints: tuple[str, str],
+    url_args: dict,
+    archive: int | None = None,
+    **context,
+):
+    """Respond with an RSS feed of the comics matching `where`.
+
+    Without `archive` this is the subscription feed: the newest comics,
+    with an RFC 5005 prev-archive link to the rest. With it, this is that
+    page of the archive, a fixed range of comic ids counting up from the
+    oldest, with links to the nearest pages that have comics in them.
+    Feeds carry ETags so readers get a 304 when nothing has changed, and
+    are streamed straight from the database cursor while they render.
+    """
+    feed_endpoint, archive_endpoint = endpoints
+    size = current_app.config["FEED_ARCHIVE_SIZE"]
+    database = database_path()
+    generation = _generation(scope, database)
+    count, newest, pages, unarchived, last = _stats(
+        scope, generation, where, params, size
+    )
+    if archive is not None:
+        if not 0 <= archive < pages:
+            abort(404)
+        found, previous, following = _neighbours(
+            scope, generation, where, params, size, pages, archive
+        )
+        if not found:
+            abort(404)
+
+    def link(endpoint, **extra):
+        return current_app.config["SERVER_ADDRESS"] + url_for(
+            endpoint, **url_args, **extra
+        )
+
+    links = {}
+    if archive is None:
+        key = (scope, generation, None, pages)
+        etag = f"{_boot}-{generation}-{newest[0] if newest else 0}-{count}-{pages}"
+        last_modified = None
+        if newest is not None:
+            last_modified = datetime.fromisoformat(newest[1]).replace(
+                tzinfo=timezone.utc
+            )
+        cache_control = None
+        links["self"] = link(feed_endpoint)
+        if last is not None:
+            links["prev-archive"] = link(archive_endpoint, page=last)
+    else:
+        key = (scope, generation, archive, previous, following)
+        etag = f"{_boot}-{generation}-a{archive}-{previous}-{following}"
+        last_modified = None
+        # the newest archive page still gains a next-archive link later on
+        cache_control = ARCHIVED if following is not None else None
+        links["current"] = link(feed_endpoint)
+        if previous is not None:
+            links["prev-archive"] = link(archive_endpoint, page=previous)
+        if following is not None:
+            links["next-archive"] = link(archive_endpoint, page=following)
+
+    if not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    ):
+        response = _respond(None, etag, last_modified, cache_control)
+        response.status_code = 304
+        return response
+    feed_cache = feed_caches.get()
+    cached = feed_cache.get(key)
+    if cached is not None:
+        return _respond(*cached)
+
+    conn = get_db_connection()
+    if archive is None:
+        # always show at least the comics that aren't archived yet
+        limit = max(current_app.config["FEED_MAX_ITEMS"], unarchived)
+        comics = conn.execute(
+            f"SELECT * FROM comics WHERE {where}"
+            " ORDER BY created DESC, id DESC LIMIT ?",
+            (*params, limit),
+        )
+    else:
+        comics = conn.execute(
+            f"SELECT * FROM comics WHERE {where} AND id > ? AND id <= ?"
+            " ORDER BY created ASC, id ASC",
+            (*params, archive * size, (archive + 1) * size),
+        )
+    chunks = stream_template(
+        template,
+        comics=comics,
+        series=series_names(),
+        artists=artist_names(),
+        types_map=mimetypes.types_map,
+        links=links,
+        archive=archive is not None,
+        **context,
+    )
+    headers = (etag, last_modified, cache_control)
+    return _respond(
+        _tee(chunks, database, scope, generation, key, headers, feed_cache), *headers
+    )
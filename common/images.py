@@ -0,0 +1,140 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+from common import pagecache
+from common.db import get_db_connection
+from common.storage import image_path, image_url
+
+# uploads are often huge, so listings show downscaled copies instead.
+# They live next to the original as {name}-{width}.{format}, and the widths
+# that were made are kept in comics.renditions (like "240.webp,480.webp")
+# so templates can build a srcset without touching the disk
+_pool: ThreadPoolExecutor | None = None
+
+
+def init_app(app):
+    global _pool
+    _pool = ThreadPoolExecutor(
+        max_workers=app.config["IMAGE_WORKERS"], thread_name_prefix="renditions"
+    )
+    app.jinja_env.globals.update(
+        image_url=image_url, image_srcset=image_srcset, image_for_width=image_for_width
+    )
+
+
+def make_renditions(
+    source: str, prefix: str, widths: tuple, fmt: str
+) -> tuple[int, list[str]]:
+    """Save downscaled copies of `source` as {prefix}-{width}.{fmt}.
+
+    Only widths smaller than the original are made, and none for animations,
+    which would stop moving. Returns the width of the original and the
+    suffixes of the renditions that were saved.
+    """
+    with Image.open(source) as original:
+        # browsers pick a rendition over the original, so animated gifs, webps
+        # and pngs are always shown as they are
+        if getattr(original, "is_animated", False) and original.format != "TIFF":
+            return original.width, []
+        # only the first page of multi-page tiffs is used
+        original.seek(0)
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        if fmt == "jpeg" and image.mode == "RGBA":
+            image = image.convert("RGB")
+        made = []
+        for width in sorted(widths):
+            if width >= image.width:
+                break
+            height = max(1, round(image.height * width / image.width))
+            rendition = image.resize((width, height), Image.Resampling.LANCZOS)
+            suffix = f"{width}.{fmt}"
+            path = f"{prefix}-{suffix}"
+            # the same image can be uploaded twice at once, so never share one
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            rendition.save(tmp, format=fmt.upper(), quality=80)
+            os.replace(tmp, path)
+            made.append(suffix)
+        return image.width, made
+
+
+def _render(app, config: dict, comic: dict):
+    # purging the pages needs the app that queued this
+    with app.app_context():
+        folder = config["UPLOAD_FOLDER"]
+        source = image_path(comic, folder=folder)
+        width, made = make_renditions(
+            source,
+            source.rsplit(".", 1)[0],
+            config["RENDITION_WIDTHS"],
+            config["RENDITION_FORMAT"],
+        )
+        conn = get_db_connection(config)
+        # every comic sharing this image shares its renditions too
+        conn.execute(
+            "UPDATE comics SET (width, renditions) = (?, ?) WHERE filehash = ?",
+            (width, ",".join(made), comic["filehash"]),
+        )
+        conn.commit()
+        # the pages showing them can use the renditions now
+        for row in conn.execute(
+            "SELECT id, artistid, seriesid FROM comics WHERE filehash = ?",
+            (comic["filehash"],),
+        ).fetchall():
+            pagecache.purge_comics(row["artistid"], row["seriesid"], comic_id=row["id"])
+
+
+def _report(future):
+    if future.exception() is not None:
+        print(f"couldn't make renditions: {future.exception()!r}")
+
+
+def queue_renditions(conn, comic_id: int):
+    """Make the renditions for a new upload on the background pool.
+
+    If the image was already uploaded before, its renditions are reused.
+    """
+    comic = dict(
+        conn.execute(
+            "SELECT id, filehash, fileext FROM comics WHERE id = ?", (comic_id,)
+        ).fetchone()
+    )
+    existing = conn.execute(
+        "SELECT width, renditions FROM comics"
+        " WHERE filehash = ? AND renditions IS NOT NULL LIMIT 1",
+        (comic["filehash"],),
+    ).fetchone()
+    if existing is not None:
+        conn.execute(
+            "UPDATE comics SET (width, renditions) = (?, ?) WHERE id = ?",
+            (*existing, comic_id),
+        )
+        conn.commit()
+        return
+    config = dict(current_app.config)
+    app = current_app._get_current_object()
+    _pool.submit(_render, app, config, comic).add_done_callback(_report)
+
+
+def image_srcset(comic) -> str:
+    candidates = [
+        f"{image_url(comic, suffix)} {suffix.split('.')[0]}w"
+        for suffix in (comic["renditions"] or "").split(",")
+        if suffix
+    ]
+    if comic["width"]:
+        candidates.append(f"{image_url(comic)} {comic['width']}w")
+    return ", ".join(candidates)
+
+
+def image_for_width(comic, width: int) -> str:
+    """The url of the smallest copy of an image at least `width` pixels wide."""
+    for suffix in (comic["renditions"] or "").split(","):
+        if suffix and int(suffix.split(".")[0]) >= width:
+            return image_url(comic, suffix)
+    return image_url(comic)
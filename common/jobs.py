@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import lookups, pagecache, storage
+from common.auth import evict_artist
+from common.db import database_path, get_db_connection
+from common.feeds import invalidate_all_feeds, invalidate_feeds
+
+# admin operations that touch a lot of rows, like deleting a prolific artist,
+# would hold the database's write lock for as long as they take. Instead they
+# are queued in the jobs table, and a background thread works through them
+# JOB_CHUNK_SIZE rows at a time, committing in between so uploads and logins
+# still get a turn. A job's progress is saved with each chunk, so one that
+# was interrupted by a restart carries on from where it got to
+#
+# a job that hasn't made progress in this long was running in a process that
+# has gone away, and is picked up again
+LEASE = 300
+# how jobs are shown in the admin panel
+DESCRIPTIONS = {
+    "delete_artist": "Delete {username}",
+    "apply_series": "Put every comic in {series}",
+}
+
+# one runner for each database, woken up by notify()
+_lock = threading.Lock()
+_wakeups: dict[str, threading.Event] = {}
+
+
+def init_app(app):
+    database = database_path(app.config)
+    with _lock:
+        if database in _wakeups:
+            return
+        _wakeups[database] = wakeup = threading.Event()
+    # for deleting files, which is mostly waiting on the disk
+    pool = ThreadPoolExecutor(
+        max_workers=app.config["JOB_FILE_WORKERS"], thread_name_prefix="jobs"
+    )
+    threading.Thread(
+        target=_run_forever, args=(app, wakeup, pool), name="jobs", daemon=True
+    ).start()
+
+
+def enqueue(conn, kind: str, **args):
+    """Queue a job, to be committed with the caller's changes.
+
+    Call notify() once the transaction has been committed.
+    """
+    conn.execute(
+        "INSERT INTO jobs (kind, args, updated) VALUES (?, ?, ?)",
+        (kind, json.dumps(args), time.time()),
+    )
+
+
+def notify():
+    wakeup = _wakeups.get(database_path())
+    if wakeup is not None:
+        wakeup.set()
+
+
+def recent_jobs(conn, limit: int = 10) -> list[dict]:
+    jobs = []
+    for row in conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)):
+        job = dict(row)
+        job["description"] = DESCRIPTIONS[job["kind"]].format(**json.loads(row["args"]))
+        jobs.append(job)
+    return jobs
+
+
+def _progress(conn, job_id: int, done: int, total: int, last_id: int = 0):
+    # committed along with the chunk it counts
+    conn.execute(
+        "UPDATE jobs SET done = ?, total = ?, last_id = ?, updated = ? WHERE id = ?",
+        (done, total, last_id, time.time(), job_id),
+    )
+    conn.commit()
+
+
+def _delete_artist(conn, config, pool, job, args):
+    artistid = args["artistid"]
+    remaining = conn.execute(
+        "SELECT count(*) FROM comics WHERE artistid = ?", (artistid,)
+    ).fetchone()[0]
+    done = job["done"]
+    total = done + remaining
+    while True:
+        comics = conn.execute(
+            "SELECT id, seriesid, fileext, filehash, renditions FROM comics"
+            " WHERE artistid = ? LIMIT ?",
+            (artistid, config["JOB_CHUNK_SIZE"]),
+        ).fetchall()
+        if not comics:
+            break
+        conn.executemany(
+            "DELETE FROM comics WHERE id = ?", [(comic["id"],) for comic in comics]
+        )
+        done += len(comics)
+        _progress(conn, job["id"], done, total)
+        # now the rows are gone, remove any images nobody else uses
+        storage.release_many(conn, comics, pool, config["UPLOAD_FOLDER"])
+        seriesids = {comic["seriesid"] for comic in comics}
+        invalidate_feeds(artistid, *seriesids)
+        pagecache.purge_comics(artistid, *seriesids)
+    conn.execute("DELETE FROM series WHERE artistid = ?", (artistid,))
+    conn.execute("DELETE FROM artists WHERE id = ?", (artistid,))
+    conn.commit()
+    evict_artist(artistid)
+    lookups.invalidate_artists()
+    lookups.invalidate_series()
+    invalidate_all_feeds()
+    pagecache.purge_all()
+
+
+def _apply_series(conn, config, pool, job, args):
+    seriesid = args["seriesid"]
+    # walk the comics by id, carrying on after the last one a resumed job got to
+    last_id = job["last_id"]
+    remaining = conn.execute(
+        "SELECT count(*) FROM comics WHERE id > ? AND seriesid IS NOT ?",
+        (last_id, seriesid),
+    ).fetchone()[0]
+    done = job["done"]
+    total = done + remaining
+    while True:
+        chunk = conn.execute(
+            "SELECT max(id) FROM"
+            " (SELECT id FROM comics WHERE id > ? ORDER BY id LIMIT ?)",
+            (last_id, config["JOB_CHUNK_SIZE"]),
+        ).fetchone()[0]
+        if chunk is None:
+            break
+        cur = conn.execute(
+            "UPDATE comics SET seriesid = ?"
+            " WHERE id > ? AND id <= ? AND seriesid IS NOT ?",
+            (seriesid, last_id, chunk, seriesid),
+        )
+        done += cur.rowcount
+        last_id = chunk
+        _progress(conn, job["id"], done, total, last_id)
+    conn.commit()
+    lookups.invalidate_series()
+    invalidate_all_feeds()
+    pagecache.purge_all()
+
+
+HANDLERS = {
+    "delete_artist": _delete_artist,
+    "apply_series": _apply_series,
+}
+
+
+def _claim(conn):
+    """Mark the oldest waiting job as running, and return it."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    job = conn.execute(
+        "SELECT * FROM jobs WHERE status = 'queued'"
+        " OR (status = 'running' AND updated < ?) ORDER BY id LIMIT 1",
+        (now - LEASE,),
+    ).fetchone()
+    if job is not None:
+        conn.execute(
+            "UPDATE jobs SET status = 'running', updated = ? WHERE id = ?",
+            (now, job["id"]),
+        )
+    conn.commit()
+    return job
+
+
+def _run_once(config, pool) -> bool:
+    """Run the next job, returning whether there was one."""
+    conn = get_db_connection(config)
+    job = _claim(conn)
+    if job is None:
+        conn.close()
+        return False
+    try:
+        HANDLERS[job["kind"]](conn, config, pool, job, json.loads(job["args"]))
+    except Exception as e:
+        print(f"job {job['id']} ({job['kind']}) failed: {e!r}")
+        conn.rollback()
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ?",
+            (repr(e), time.time(), job["id"]),
+        )
+    else:
+        conn.execute(
+            "UPDATE jobs SET status = 'done', updated = ? WHERE id = ?",
+            (time.time(), job["id"]),
+        )
+    conn.commit()
+    conn.close()
+    return True
+
+
+def _run_forever(app, wakeup: threading.Event, pool: ThreadPoolExecutor):
+    config = dict(app.config)
+    while True:
+        try:
+            # jobs purge the caches of the app that started them
+            with app.app_context():
+                ran = _run_once(config, pool)
+            if not ran:
+                if wakeup.wait(config["JOB_POLL_INTERVAL"]):
+                    wakeup.clear()
+        except Exception as e:
+            print(f"job runner failed: {e!r}")
+            get_db_connection(config).close()
+            time.sleep(config["JOB_POLL_INTERVAL"])
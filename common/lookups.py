@@ -0,0 +1,100 @@
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from common.db import database_path, get_db_connection
+
+# listing pages only need the names of artists and series to label their
+# stickies, so keep the id -> name maps around instead of rebuilding them
+# from the whole table on every request
+QUERIES = {
+    "artists": "SELECT id, username FROM artists",
+    "series": "SELECT id, name FROM series",
+}
+# changes made behind the app's back (like admin_tools) show up after this long
+DEFAULT_TTL = 300
+
+_lock = threading.Lock()
+# (database, table) -> (when it was read, id -> name), and how often each
+# has been invalidated
+_cache: dict[tuple[str, str], tuple[float, dict[int, str]]] = {}
+_generations: dict[tuple[str, str], int] = {}
+
+
+def _ttl() -> float:
+    if has_app_context():
+        return current_app.config.get("LOOKUP_CACHE_TTL", DEFAULT_TTL)
+    return DEFAULT_TTL
+
+
+def _load(table: str) -> dict[int, str]:
+    conn = get_db_connection()
+    return {row[0]: row[1] for row in conn.execute(QUERIES[table]).fetchall()}
+
+
+def _lookup(table: str) -> dict[int, str]:
+    key = (database_path(), table)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < _ttl():
+            return entry[1]
+        generation = _generations.get(key, 0)
+    mapping = _load(table)
+    with _lock:
+        # if someone invalidated the table while we were reading it,
+        # hand back what we read but don't keep it around
+        if _generations.get(key, 0) == generation:
+            _cache[key] = (time.monotonic(), mapping)
+    return mapping
+
+
+def artist_names() -> dict[int, str]:
+    """id -> username for every artist. Don't modify the returned dict!"""
+    return _lookup("artists")
+
+
+def series_names() -> dict[int, str]:
+    """id -> name for every series. Don't modify the returned dict!"""
+    return _lookup("series")
+
+
+def _invalidate(table: str):
+    key = (database_path(), table)
+    with _lock:
+        _generations[key] = _generations.get(key, 0) + 1
+        _cache.pop(key, None)
+
+
+def invalidate_artists():
+    _invalidate("artists")
+
+
+def invalidate_series():
+    _invalidate("series")
+
+
+def check_consistency() -> list[str]:
+    """Compare the cached maps against the database.
+
+    Returns a description of every difference found, so an empty list
+    means the cache is consistent.
+    """
+    problems = []
+    for table in QUERIES:
+        with _lock:
+            entry = _cache.get((database_path(), table))
+        if entry is None:
+            continue
+        cached = entry[1]
+        actual = _load(table)
+        for key in cached.keys() - actual.keys():
+            problems.append(f"{table} {key} is cached but no longer exists")
+        for key in actual.keys() - cached.keys():
+            problems.append(f"{table} {key} exists but is missing from the cache")
+        for key in cached.keys() & actual.keys():
+            if cached[key] != actual[key]:
+                problems.append(
+                    f'{table} {key} is cached as "{cached[key]}" but is "{actual[key]}"'
+                )
+    return problems
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from flask import current_app, g, request
+
+from common.db import query_stats
+
+# how long each page takes, how many queries it makes and how long they take,
+# and how logins are checked, for /admin/metrics in prometheus' text format.
+# Everything is counted per endpoint (the view function's name), so pages
+# for different artists or comics add up together
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# endpoint -> [count, total seconds, count per bucket]
+_durations: dict[str, list] = {}
+# (endpoint, status) -> requests
+_responses: dict[tuple[str, int], int] = {}
+# endpoint -> [queries, seconds]
+_queries: dict[str, list] = {}
+# outcome -> checks
+_auth: dict[str, int] = {}
+
+
+def init_app(app):
+    app.before_request(_start)
+    app.after_request(_finish)
+
+
+def _start():
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = query_stats()
+
+
+def _finish(response):
+    if "metrics_started" not in g:
+        # before_request never ran, like when another hook failed first
+        return response
+    duration = time.perf_counter() - g.metrics_started
+    queries, query_time = query_stats()
+    queries -= g.metrics_queries[0]
+    query_time -= g.metrics_queries[1]
+    endpoint = request.endpoint or "unmatched"
+    with _lock:
+        durations = _durations.setdefault(endpoint, [0, 0.0, [0] * len(BUCKETS)])
+        durations[0] += 1
+        durations[1] += duration
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                durations[2][i] += 1
+        key = (endpoint, response.status_code)
+        _responses[key] = _responses.get(key, 0) + 1
+        totals = _queries.setdefault(endpoint, [0, 0.0])
+        totals[0] += queries
+        totals[1] += query_time
+    if current_app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = (
+            f"app;dur={duration * 1000:.1f}, "
+            f'db;dur={query_time * 1000:.1f};desc="{queries} queries"'
+        )
+    return response
+
+
+def count_auth(outcome: str):
+    """Count one check_token outcome, like "anonymous" or "expired"."""
+    with _lock:
+        _auth[outcome] = _auth.get(outcome, 0) + 1
+
+
+def _labels(**labels) -> str:
+    # endpoints and outcomes are python names, so they never need escaping
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def render() -> str:
+    lines = []
+    with _lock:
+        lines.append(
+            "# HELP comicworld_request_duration_seconds Time taken to respond to a request."
+        )
+        lines.append("# TYPE comicworld_request_duration_seconds histogram")
+        for endpoint, (count, total, buckets) in sorted(_durations.items()):
+            for bound, bucket in zip(BUCKETS, buckets):
+                labels = _labels(endpoint=endpoint, le=bound)
+                lines.append(
+                    f"comicworld_request_duration_seconds_bucket{{{labels}}} {bucket}"
+                )
+            labels = _labels(endpoint=endpoint, le="+Inf")
+            lines.append(
+                f"comicworld_request_duration_seconds_bucket{{{labels}}} {count}"
+            )
+            labels = _labels(endpoint=endpoint)
+            lines.append(f"comicworld_request_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(
+                f"comicworld_request_duration_seconds_count{{{labels}}} {count}"
+            )
+
+        lines.append("# HELP comicworld_responses_total Responses sent, by status.")
+        lines.append("# TYPE comicworld_responses_total counter")
+        for (endpoint, status), count in sorted(_responses.items()):
+            labels = _labels(endpoint=endpoint, status=status)
+            lines.append(f"comicworld_responses_total{{{labels}}} {count}")
+
+        lines.append("# HELP comicworld_db_queries_total Database statements run.")
+        lines.append("# TYPE comicworld_db_queries_total counter")
+        for endpoint, (count, _) in sorted(_queries.items()):
+            labels = _labels(endpoint=endpoint)
+            lines.append(f"comicworld_db_queries_total{{{labels}}} {count}")
+        lines.append(
+            "# HELP comicworld_db_query_seconds_total Time spent running statements"
+            " and fetching their rows."
+        )
+        lines.append("# TYPE comicworld_db_query_seconds_total counter")
+        for endpoint, (_, seconds) in sorted(_queries.items()):
+            labels = _labels(endpoint=endpoint)
+            lines.append(f"comicworld_db_query_seconds_total{{{labels}}} {seconds}")
+
+        lines.append("# HELP comicworld_auth_checks_total Logins checked, by outcome.")
+        lines.append("# TYPE comicworld_auth_checks_total counter")
+        for outcome, count in sorted(_auth.items()):
+            labels = _labels(outcome=outcome)
+            lines.append(f"comicworld_auth_checks_total{{{labels}}} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,220 @@
+import functools
+import hashlib
+import os
+import time
+
+from flask import current_app, g, request, session
+
+from common.cache import PerDatabase, TaggedCache
+from common.db import database_path, get_db_connection
+from common.templating import card_caches
+
+# most visitors aren't logged in, and they all see exactly the same pages, so
+# those are kept once rendered. Each page is tagged with what it shows:
+#
+#   "index"          every comic, like / and comics read from the index
+#   "artists"        the list of artists
+#   "series"         the list of series
+#   "artist:<id>"    an artist's comics
+#   "series:<id>"    a series' comics
+#   "comic:<id>"     a single comic
+#
+# and anything that changes one of those purges its tags. Pages can also be
+# kept on disk (PAGE_CACHE_DISK), so a restart doesn't start from nothing
+page_caches = PerDatabase(
+    lambda config: TaggedCache(
+        maxsize=config.get("PAGE_CACHE_SIZE", 256),
+        ttl=config.get("PAGE_CACHE_TTL", 300),
+    )
+)
+# database -> the pages.db to keep its pages in, for those that do
+_disks: dict[str, dict] = {}
+_disk_size = 0
+
+# rendered pages depend on the code and templates too, so pages on disk are
+# only used by a process running the same ones
+_release = ""
+
+DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    body BLOB NOT NULL,
+    mimetype TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS page_tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL REFERENCES pages(key) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS page_tags_tag ON page_tags (tag);
+CREATE INDEX IF NOT EXISTS page_tags_key ON page_tags (key);
+CREATE INDEX IF NOT EXISTS pages_created ON pages (created);
+"""
+
+
+def init_app(app):
+    global _release, _disk_size
+    page_caches.get(app.config)
+    _release = _fingerprint(app.root_path)
+    if app.config["PAGE_CACHE_DISK"]:
+        os.makedirs(app.config["CACHE_FOLDER"], exist_ok=True)
+        disk = {"DATABASE": os.path.join(app.config["CACHE_FOLDER"], "pages.db")}
+        _disks[database_path(app.config)] = disk
+        _disk_size = app.config["PAGE_CACHE_DISK_SIZE"]
+        conn = _disk_connection(disk)
+        conn.executescript(DISK_SCHEMA)
+        conn.execute("DELETE FROM pages WHERE key NOT LIKE ?", (f"{_release}|%",))
+        conn.commit()
+
+
+def _fingerprint(root: str) -> str:
+    digest = hashlib.sha1()
+    for folder, dirs, files in os.walk(root):
+        if folder == root:
+            # not the comics, database or cache
+            dirs[:] = [d for d in dirs if d in ("blueprints", "common", "templates")]
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith((".py", ".jinja")):
+                stat = os.stat(os.path.join(folder, name))
+                digest.update(f"{folder}/{name}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:12]
+
+
+def _disk() -> dict | None:
+    return _disks.get(database_path())
+
+
+def _disk_connection(disk: dict):
+    conn = get_db_connection(disk)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def tag_page(*tags: str):
+    """Say what the page being rendered shows, so it is purged along with it."""
+    g.setdefault("page_tags", set()).update(tags)
+
+
+def _key(vary=None) -> str:
+    darkmode = "dark" if request.cookies.get("darkmode") else "light"
+    # apps on different databases might share a CACHE_FOLDER
+    key = f"{_release}|{database_path()}|{darkmode}|{request.full_path}"
+    if vary is not None:
+        key += f"|{vary()}"
+    return key
+
+
+def _disk_get(disk: dict, key: str):
+    conn = _disk_connection(disk)
+    row = conn.execute(
+        "SELECT body, mimetype FROM pages WHERE key = ? AND created > ?",
+        (key, time.time() - page_caches.get().ttl),
+    ).fetchone()
+    if row is None:
+        conn.close()
+        return None, ()
+    tags = conn.execute("SELECT tag FROM page_tags WHERE key = ?", (key,))
+    tags = {tag[0] for tag in tags}
+    conn.close()
+    return (row["body"], row["mimetype"]), tags
+
+
+def _disk_set(disk: dict, key: str, value: tuple, tags: set):
+    conn = _disk_connection(disk)
+    conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+    conn.execute(
+        "INSERT INTO pages (key, created, body, mimetype) VALUES (?, ?, ?, ?)",
+        (key, time.time(), *value),
+    )
+    conn.executemany(
+        "INSERT INTO page_tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags]
+    )
+    # keep only the newest pages
+    conn.execute(
+        "DELETE FROM pages WHERE created < ("
+        " SELECT created FROM pages ORDER BY created DESC LIMIT 1 OFFSET ?)",
+        (_disk_size,),
+    )
+    conn.commit()
+
+
+def purge(*tags: str):
+    """Throw away every cached page, and comic card, with any of these tags."""
+    page_caches.get().purge(*tags)
+    card_caches.get().purge(*tags)
+    disk = _disk()
+    if disk is not None:
+        conn = _disk_connection(disk)
+        conn.executemany(
+            "DELETE FROM pages WHERE key IN (SELECT key FROM page_tags WHERE tag = ?)",
+            [(tag,) for tag in tags],
+        )
+        conn.commit()
+
+
+def purge_comics(artistid: int | None, *seriesids: int | None, comic_id=None):
+    """Purge the pages showing a comic that was added, changed or deleted."""
+    tags = ["index", f"artist:{artistid}"]
+    tags += [f"series:{seriesid}" for seriesid in seriesids if seriesid is not None]
+    if comic_id is not None:
+        tags.append(f"comic:{comic_id}")
+    purge(*tags)
+
+
+def purge_all():
+    # for changes that show up on nearly every page, like renaming a series
+    page_caches.get().clear()
+    card_caches.get().clear()
+    disk = _disk()
+    if disk is not None:
+        conn = _disk_connection(disk)
+        conn.execute("DELETE FROM pages")
+        conn.commit()
+
+
+def cached_page(f=None, *, vary=None):
+    """Serve the page from the cache for anyone who isn't logged in.
+
+    Goes underneath check_token, so it knows whether someone is. Pages that
+    change with more than their url, like the reader following the Referer,
+    pass `vary`, which returns what else they depend on.
+    """
+    if f is None:
+        return functools.partial(cached_page, vary=vary)
+
+    @functools.wraps(f)
+    def decorated(login_artist, *args, **kwargs):
+        page_cache = page_caches.get()
+        if login_artist is not None or page_cache.maxsize == 0 or "_flashes" in session:
+            return f(login_artist, *args, **kwargs)
+        key = _key(vary)
+        disk = _disk()
+        cached = page_cache.get(key)
+        if cached is None and disk is not None:
+            cached, tags = _disk_get(disk, key)
+            if cached is not None:
+                page_cache.set(key, cached, tags)
+        if cached is not None:
+            response = current_app.response_class(cached[0], mimetype=cached[1])
+            response.headers["X-Cache"] = "HIT"
+            return response
+
+        generation = page_cache.generation
+        response = current_app.make_response(f(login_artist, *args, **kwargs))
+        if (
+            response.status_code == 200
+            and not response.is_streamed
+            and "Set-Cookie" not in response.headers
+            # a purge while we were rendering means this may already be stale
+            and page_cache.generation == generation
+        ):
+            tags = g.get("page_tags", set())
+            value = (response.get_data(), response.mimetype)
+            page_cache.set(key, value, tags)
+            if disk is not None:
+                _disk_set(disk, key, value, tags)
+        response.headers["X-Cache"] = "MISS"
+        return response
+
+    return decorated
@@ -0,0 +1,83 @@
+from flask import request
+
+# pages are 50 items long
+PAGE_SIZE = 50
+
+
+class Page:
+    def __init__(self, comics: list, newer: str | None, older: str | None):
+        self.comics = comics
+        # cursors for the pages either side of this one, None if there isn't one
+        self.newer = newer
+        self.older = older
+
+
+def make_cursor(comic) -> str:
+    return f"{comic['created']},{comic['id']}"
+
+
+def parse_cursor(cursor: str | None) -> tuple[str, int] | None:
+    if not cursor:
+        return None
+    try:
+        created, comic_id = cursor.rsplit(",", 1)
+        return created, int(comic_id)
+    except ValueError:
+        return None
+
+
+def _exists(conn, where: str, params: tuple, comparison: str, comic) -> bool:
+    return (
+        conn.execute(
+            f"SELECT 1 FROM comics WHERE {where} AND (created, id) {comparison} (?, ?) LIMIT 1",
+            (*params, comic["created"], comic["id"]),
+        ).fetchone()
+        is not None
+    )
+
+
+def paginate_comics(conn, where: str = "1", params: tuple = ()) -> Page:
+    """Fetch one page of comics matching `where`, newest first.
+
+    Pages are found with the ?before= and ?after= cursors, which seek
+    straight to the right spot in the (created, id) indexes rather than
+    counting past every earlier comic. ?page= is still understood so old
+    links keep working, but every page links onwards with cursors.
+    """
+    before = parse_cursor(request.args.get("before"))
+    after = parse_cursor(request.args.get("after"))
+    page = request.args.get("page", type=int)
+    if after is not None:
+        # walk towards the newest comics, then flip the page back around
+        comics = conn.execute(
+            f"SELECT * FROM comics WHERE {where} AND (created, id) > (?, ?)"
+            " ORDER BY created ASC, id ASC LIMIT ?",
+            (*params, *after, PAGE_SIZE + 1),
+        ).fetchall()
+        hasnewer = len(comics) > PAGE_SIZE
+        comics = comics[:PAGE_SIZE]
+        comics.reverse()
+        hasolder = bool(comics) and _exists(conn, where, params, "<", comics[-1])
+    else:
+        if before is not None:
+            comics = conn.execute(
+                f"SELECT * FROM comics WHERE {where} AND (created, id) < (?, ?)"
+                " ORDER BY created DESC, id DESC LIMIT ?",
+                (*params, *before, PAGE_SIZE + 1),
+            ).fetchall()
+        else:
+            offset = max((page or 1) - 1, 0) * PAGE_SIZE
+            # request one more comic than we need, purely to see if it exists
+            comics = conn.execute(
+                f"SELECT * FROM comics WHERE {where}"
+                " ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                (*params, PAGE_SIZE + 1, offset),
+            ).fetchall()
+        hasolder = len(comics) > PAGE_SIZE
+        comics = comics[:PAGE_SIZE]
+        hasnewer = bool(comics) and _exists(conn, where, params, ">", comics[0])
+    return Page(
+        comics,
+        make_cursor(comics[0]) if hasnewer else None,
+        make_cursor(comics[-1]) if hasolder else None,
+    )
@@ -0,0 +1,111 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# hashing a password is deliberately slow, and on a request thread it holds
+# the GIL the whole time, so a burst of logins would stall every other page.
+# Instead it happens in a few worker processes. Only so many hashes may be
+# running or waiting at once; past that, people are told to try again
+# rather than piling up behind each other. Each app has its own workers, in
+# app.extensions["passwords"]
+#
+# in each worker, PASSWORD_HASH_METHOD as werkzeug writes it in a hash
+_resolved: dict[str, str] = {}
+
+
+class _Workers:
+    """One app's password worker processes, and its slots for waiting on them."""
+
+    def __init__(self, workers: int, queue: int):
+        self.workers = workers
+        self.pool = self._new_pool()
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.lock = threading.Lock()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # forking a process with threads running is asking for trouble
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def replace(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        with self.lock:
+            # unless another request already has
+            if self.pool is broken:
+                self.pool = self._new_pool()
+                broken.shutdown(wait=False)
+            return self.pool
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def init_app(app):
+    previous = app.extensions.get("passwords")
+    if previous is not None:
+        previous.shutdown()
+    app.extensions["passwords"] = _Workers(
+        app.config["PASSWORD_WORKERS"], app.config["PASSWORD_QUEUE"]
+    )
+
+
+def _method(passhash: str) -> str:
+    # werkzeug hashes look like "scrypt:32768:8:1$salt$hash"
+    return passhash.split("$", 1)[0]
+
+
+def _resolve(method: str) -> str:
+    # settings like "scrypt" or "pbkdf2:sha256" leave out the parameters
+    # werkzeug fills in, so hash something once to see what they end up as
+    if method not in _resolved:
+        _resolved[method] = _method(generate_password_hash("", method))
+    return _resolved[method]
+
+
+def _verify(passhash: str, password: str, method: str) -> tuple[bool, str | None]:
+    if not check_password_hash(passhash, password):
+        return False, None
+    if _method(passhash) != _resolve(method):
+        # hashed with older or weaker settings, so hash it again while we can
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+def _run(function, *args):
+    workers = current_app.extensions["passwords"]
+    if not workers.slots.acquire(blocking=False):
+        raise ServiceUnavailable(
+            "Lots of people are logging in right now, please try again in a moment!",
+            retry_after=2,
+        )
+    try:
+        pool = workers.pool
+        try:
+            return pool.submit(function, *args).result()
+        except BrokenProcessPool:
+            # a worker died, maybe killed for using too much memory, which
+            # breaks the whole pool; start a new one and try once more
+            current_app.logger.warning("password workers died, starting new ones")
+            return workers.replace(pool).submit(function, *args).result()
+    finally:
+        workers.slots.release()
+
+
+def hash_password(password: str) -> str:
+    return _run(
+        generate_password_hash, password, current_app.config["PASSWORD_HASH_METHOD"]
+    )
+
+
+def verify_password(passhash: str, password: str) -> tuple[bool, str | None]:
+    """Check a password against its hash.
+
+    Returns whether it matched, and a new hash to store if the old one
+    doesn't use PASSWORD_HASH_METHOD.
+    """
+    return _run(_verify, passhash, password, current_app.config["PASSWORD_HASH_METHOD"])
@@ -0,0 +1,144 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+from flask import current_app, make_response, request
+
+# an admin can add ?profile to any page that checks their login (or send an
+# X-Profile header) to see where its time goes. The request is run under
+# cProfile, and sampled at the same time for a flamegraph. Each profile is
+# saved in CACHE_FOLDER/profiles as:
+#
+#   {name}.json        what was profiled, and how long it took
+#   {name}.prof        the cProfile stats, for pstats or snakeviz
+#   {name}.collapsed   sampled stacks, for flamegraph.pl or speedscope
+#
+# and only the newest PROFILE_KEEP are kept
+SUFFIXES = (".json", ".prof", ".collapsed")
+
+
+def folder() -> str:
+    return os.path.join(current_app.config["CACHE_FOLDER"], "profiles")
+
+
+def requested() -> bool:
+    # check_token then makes sure they're an admin before calling run()
+    return "profile" in request.args or "X-Profile" in request.headers
+
+
+class Sampler(threading.Thread):
+    """Records the stack of one thread every `interval` seconds."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: dict[str, int] = {}
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                collapsed = ";".join(reversed(stack))
+                self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+
+    def stop(self) -> dict[str, int]:
+        self.finished.set()
+        self.join()
+        return self.stacks
+
+
+def run(f, *args, **kwargs):
+    """Call a view, saving a profile of it. Only for admins' requests."""
+    profiler = cProfile.Profile()
+    sampler = Sampler(
+        threading.get_ident(), current_app.config["PROFILE_SAMPLE_INTERVAL"]
+    )
+    sampler.start()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        response = make_response(f(*args, **kwargs))
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - started
+        stacks = sampler.stop()
+    name = _save(profiler, stacks, duration)
+    response.headers["X-Profile"] = name
+    return response
+
+
+def _save(profiler: cProfile.Profile, stacks: dict, duration: float) -> str:
+    path = folder()
+    os.makedirs(path, exist_ok=True)
+    name = f"{time.time_ns() // 1000000}-{request.endpoint}"
+    profiler.dump_stats(os.path.join(path, f"{name}.prof"))
+    with open(os.path.join(path, f"{name}.collapsed"), "w") as f:
+        for stack, count in stacks.items():
+            f.write(f"{stack} {count}\n")
+    with open(os.path.join(path, f"{name}.json"), "w") as f:
+        json.dump(
+            {
+                "name": name,
+                "created": time.time(),
+                "path": request.full_path,
+                "endpoint": request.endpoint,
+                "duration": duration,
+                "samples": sum(stacks.values()),
+            },
+            f,
+        )
+    _trim(path)
+    return name
+
+
+def _trim(path: str):
+    names = sorted(
+        name.removesuffix(".json")
+        for name in os.listdir(path)
+        if name.endswith(".json")
+    )
+    # everything but the newest PROFILE_KEEP, the names start with the time
+    for name in names[: max(len(names) - current_app.config["PROFILE_KEEP"], 0)]:
+        for suffix in SUFFIXES:
+            try:
+                os.remove(os.path.join(path, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def recent() -> list[dict]:
+    path = folder()
+    if not os.path.isdir(path):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(path), reverse=True):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(path, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                # removed or still being written
+                continue
+    return profiles
+
+
+def summary(name: str, limit: int = 40) -> str:
+    """The slowest functions of a saved profile, as pstats prints them."""
+    out = io.StringIO()
+    stats = pstats.Stats(os.path.join(folder(), f"{name}.prof"), stream=out)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,61 @@
+import re
+
+# comics, series and artists each have an fts5 index (comics_search,
+# series_search and artists_search), kept up to date by triggers on their
+# tables. See schema.sql
+PAGE_SIZE = 50
+# names shown above the comics on the first page of results
+MAX_NAMES = 10
+# more words than this are ignored, they only make the query slower
+MAX_TERMS = 8
+# ranking every match is what makes a search slow, so when a search matches
+# more comics than this, only the newest of them are ranked
+MAX_MATCHES = 10000
+
+
+def match_expression(query: str) -> str | None:
+    """Turn a search into an fts5 query, or None if there is nothing to search.
+
+    Every word has to match, and matches the start of a word, so "spid man"
+    finds "Spider-Man". Words are quoted, so nothing typed is fts5 syntax.
+    """
+    terms = []
+    for word in re.findall(r"\w+", query)[:MAX_TERMS]:
+        # single letters aren't in the prefix index, so only match them exactly
+        terms.append(f'"{word}"' if len(word) == 1 else f'"{word}"*')
+    return " ".join(terms) or None
+
+
+def search_comics(conn, expression: str, page: int) -> tuple[list, bool]:
+    """Fetch one page of comics matching `expression`, best matches first.
+
+    Returns the comics, and whether there is another page after this one.
+    """
+    comics = conn.execute(
+        """
+        SELECT comics.* FROM (
+            SELECT rowid, rank FROM (
+                SELECT rowid, rank FROM comics_search WHERE comics_search MATCH ?
+                ORDER BY rowid DESC LIMIT ?
+            ) ORDER BY rank LIMIT ? OFFSET ?
+        ) AS hits JOIN comics ON comics.id = hits.rowid
+        ORDER BY hits.rank
+        """,
+        (expression, MAX_MATCHES, PAGE_SIZE + 1, (page - 1) * PAGE_SIZE),
+    ).fetchall()
+    return comics[:PAGE_SIZE], len(comics) > PAGE_SIZE
+
+
+def search_names(conn, expression: str) -> tuple[list[str], list[str]]:
+    """Return the names of the artists and series matching `expression`."""
+    artists = conn.execute(
+        "SELECT username FROM artists_search WHERE artists_search MATCH ?"
+        " ORDER BY rank LIMIT ?",
+        (expression, MAX_NAMES),
+    ).fetchall()
+    series = conn.execute(
+        "SELECT name FROM series_search WHERE series_search MATCH ?"
+        " ORDER BY rank LIMIT ?",
+        (expression, MAX_NAMES),
+    ).fetchall()
+    return [row[0] for row in artists], [row[0] for row in series]
@@ -0,0 +1,235 @@
+import gzip
+import json
+import os
+import threading
+import time
+from xml.sax.saxutils import escape
+
+from flask import current_app, url_for
+
+from common.cache import PerDatabase
+from common.db import get_db_connection
+
+# pages that aren't generated from the database
+PAGES = (
+    "index",
+    "auth.login",
+    "artists.list",
+    "series.list",
+    "rss",
+    "auth.create_account",
+    "tos",
+)
+
+# search engines won't read more than 50,000 urls from one sitemap, so
+# comics, artists and series are split into shards by id range, and each
+# shard is only re-rendered when the aggregates below say it has changed
+FINGERPRINTS = {
+    "comics": """
+        SELECT id / :size, count(*), total(id), min(created), max(created)
+        FROM comics GROUP BY 1
+    """,
+    "artists": """
+        SELECT a.id / :size, count(*), total(a.id), max(coalesce(c.newest, a.created))
+        FROM artists a LEFT JOIN (
+            SELECT artistid, max(created) AS newest FROM comics GROUP BY artistid
+        ) c ON c.artistid = a.id
+        GROUP BY 1
+    """,
+    "series": """
+        SELECT s.id / :size, count(*), total(s.id), max(c.newest)
+        FROM series s LEFT JOIN (
+            SELECT seriesid, max(created) AS newest FROM comics GROUP BY seriesid
+        ) c ON c.seriesid = s.id
+        GROUP BY 1
+    """,
+}
+
+# each query returns (url argument, lastmod) for one shard
+SHARDS = {
+    "comics": (
+        "comics.comic",
+        "comic_id",
+        """
+        SELECT id, created FROM comics
+        WHERE id >= :start AND id < :end ORDER BY id
+        """,
+    ),
+    "artists": (
+        "artists.artist",
+        "artist",
+        """
+        SELECT a.username, coalesce(max(c.created), a.created) FROM artists a
+        LEFT JOIN comics c ON c.artistid = a.id
+        WHERE a.id >= :start AND a.id < :end GROUP BY a.id ORDER BY a.id
+        """,
+    ),
+    "series": (
+        "series.series",
+        "seriesName",
+        """
+        SELECT s.name, max(c.created) FROM series s
+        LEFT JOIN comics c ON c.seriesid = s.id
+        WHERE s.id >= :start AND s.id < :end GROUP BY s.id ORDER BY s.id
+        """,
+    ),
+}
+
+_lock = threading.Lock()
+
+
+class _State:
+    def __init__(self):
+        self.manifest: dict | None = None
+        self.last_refresh = 0.0
+        # shards that changed in ways the fingerprints can't see, like a rename
+        self.dirty: set[str] = set()
+
+
+_states = PerDatabase(lambda config: _State())
+
+
+def _folder() -> str:
+    return os.path.join(current_app.config["CACHE_FOLDER"], "sitemaps")
+
+
+def _manifest_path() -> str:
+    return os.path.join(_folder(), "manifest.json")
+
+
+def _read_manifest() -> dict:
+    try:
+        with open(_manifest_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomically(path: str, write):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _lastmod(created: str | None) -> str | None:
+    if created is None:
+        return None
+    # sqlite timestamps are UTC, sitemaps want W3C datetimes
+    return created.replace(" ", "T") + "+00:00"
+
+
+def _url(endpoint: str, **values) -> str:
+    return current_app.config["SERVER_ADDRESS"] + url_for(endpoint, **values)
+
+
+def _write_urlset(path: str, urls):
+    def write(tmp):
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+            for loc, lastmod in urls:
+                f.write(f"<url><loc>{escape(loc)}</loc>")
+                if lastmod is not None:
+                    f.write(f"<lastmod>{lastmod}</lastmod>")
+                f.write("</url>\n")
+            f.write("</urlset>\n")
+
+    _write_atomically(path, write)
+
+
+def _render_shard(conn, kind: str, shard: int, size: int):
+    endpoint, argument, query = SHARDS[kind]
+    rows = conn.execute(query, {"start": shard * size, "end": (shard + 1) * size})
+    _write_urlset(
+        shard_path(f"{kind}-{shard}"),
+        ((_url(endpoint, **{argument: row[0]}), _lastmod(row[1])) for row in rows),
+    )
+
+
+def shard_path(name: str) -> str:
+    return os.path.join(_folder(), f"{name}.xml.gz")
+
+
+def invalidate_shard(kind: str, row_id: int):
+    """Force a shard to be re-rendered, for changes the fingerprints miss."""
+    state = _states.get()
+    size = current_app.config["SITEMAP_SHARD_SIZE"]
+    with _lock:
+        state.dirty.add(f"{kind}-{row_id // size}")
+        state.last_refresh = 0.0
+
+
+def refresh() -> dict:
+    """Bring the shards on disk up to date and return the manifest.
+
+    The database is only checked every SITEMAP_TTL seconds, and only
+    shards whose fingerprint changed (or whose file is missing) are
+    rendered again.
+    """
+    state = _states.get()
+    with _lock:
+        if state.manifest is None:
+            # pick up where the last process left off
+            state.manifest = _read_manifest()
+        manifest = state.manifest
+        if (
+            manifest
+            and time.monotonic() - state.last_refresh
+            < current_app.config["SITEMAP_TTL"]
+        ):
+            return manifest
+        os.makedirs(_folder(), exist_ok=True)
+        size = current_app.config["SITEMAP_SHARD_SIZE"]
+        conn = get_db_connection()
+        shards = {"pages-0": {"fingerprint": list(PAGES), "lastmod": None}}
+        if "pages-0" not in manifest or not os.path.exists(shard_path("pages-0")):
+            _write_urlset(shard_path("pages-0"), ((_url(page), None) for page in PAGES))
+        for kind, query in FINGERPRINTS.items():
+            for shard, *fingerprint in conn.execute(query, {"size": size}):
+                name = f"{kind}-{shard}"
+                old = manifest.get(name)
+                if (
+                    old is None
+                    or name in state.dirty
+                    or old["fingerprint"] != fingerprint
+                    or not os.path.exists(shard_path(name))
+                ):
+                    _render_shard(conn, kind, shard, size)
+                shards[name] = {
+                    "fingerprint": fingerprint,
+                    "lastmod": _lastmod(fingerprint[-1]),
+                }
+        conn.close()
+        # shards that are now empty are dropped from the index
+        for name in manifest.keys() - shards.keys():
+            try:
+                os.remove(shard_path(name))
+            except FileNotFoundError:
+                pass
+
+        def write(tmp):
+            with open(tmp, "w") as f:
+                json.dump(shards, f)
+
+        _write_atomically(_manifest_path(), write)
+        state.dirty.clear()
+        state.manifest = shards
+        state.last_refresh = time.monotonic()
+        return shards
+
+
+def render_index() -> str:
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+    ]
+    for name, shard in refresh().items():
+        loc = escape(_url("sitemap_shard", name=name))
+        lastmod = shard["lastmod"]
+        lines.append(
+            f"<sitemap><loc>{loc}</loc>"
+            + (f"<lastmod>{lastmod}</lastmod>" if lastmod else "")
+            + "</sitemap>"
+        )
+    lines.append("</sitemapindex>")
+    return "\n".join(lines)
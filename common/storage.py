@@ -0,0 +1,230 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+
+from flask import Request, current_app, request
+
+# images are stored under the sha256 of their contents, fanned out as
+# ab/cd/abcd....{ext} so no one directory gets too big. A name can never
+# point at different contents, so browsers may cache them forever, and
+# uploading the same image twice only stores it once. Comics from before
+# this (with no filehash) are still at {id}.{ext}
+HASHED_NAME = re.compile(r"^comics/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}[.-]")
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+CHUNK_SIZE = 1024 * 1024
+
+# the first bytes of each format we accept, and the extension it is stored as
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+# other names older comics were saved under, for what sniff() calls them
+ALIASES = {"jpeg": "jpg", "jpe": "jpg", "tif": "tiff"}
+
+# held while checking whether a file is still referenced, so an upload of the
+# same image can't be committed in between that check and the file's removal
+lock = threading.Lock()
+
+
+class HashingFile:
+    """A temporary file in UPLOAD_FOLDER/tmp that hashes what is written to it."""
+
+    def __init__(self, folder: str):
+        os.makedirs(os.path.join(folder, "tmp"), exist_ok=True)
+        self.path = os.path.join(folder, "tmp", uuid.uuid4().hex)
+        self.file = open(self.path, "wb+")
+        self.digest = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    # werkzeug spools uploads to memory or /tmp before we ever see them, and
+    # then they would have to be copied and hashed again. Instead write them
+    # straight to where they will be published from, hashing as they arrive
+    def _get_file_stream(self, *args, **kwargs):
+        upload = HashingFile(current_app.config["UPLOAD_FOLDER"])
+        if not hasattr(self, "uploads"):
+            self.uploads = []
+        self.uploads.append(upload)
+        return upload
+
+
+def init_app(app):
+    app.request_class = UploadRequest
+    app.after_request(_immutable)
+    app.teardown_request(_remove_uploads)
+
+
+def _remove_uploads(exception=None):
+    # anything that wasn't stored was rejected, or the request failed
+    for upload in getattr(request, "uploads", ()):
+        upload.file.close()
+        try:
+            os.remove(upload.path)
+        except FileNotFoundError:
+            pass
+
+
+def _immutable(response):
+    if request.endpoint == "static" and HASHED_NAME.match(
+        (request.view_args or {}).get("filename", "")
+    ):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def normal_fileext(fileext: str) -> str:
+    """The one extension an image's format is stored under, like sniff()'s."""
+    fileext = fileext.lower()
+    return ALIASES.get(fileext, fileext)
+
+
+def hashed_name(filehash: str, fileext: str) -> str:
+    return f"{filehash[:2]}/{filehash[2:4]}/{filehash}.{fileext}"
+
+
+def _name(comic, rendition: str | None = None) -> str:
+    if comic["filehash"] is None:
+        stem = str(comic["id"])
+    else:
+        filehash = comic["filehash"]
+        stem = f"{filehash[:2]}/{filehash[2:4]}/{filehash}"
+    if rendition is None:
+        return f"{stem}.{comic['fileext']}"
+    return f"{stem}-{rendition}"
+
+
+def image_path(comic, rendition: str | None = None, folder: str | None = None):
+    if folder is None:
+        folder = current_app.config["UPLOAD_FOLDER"]
+    return os.path.join(folder, _name(comic, rendition))
+
+
+def image_url(comic, rendition: str | None = None) -> str:
+    return f"/static/comics/{_name(comic, rendition)}"
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def place(tmp: str, filehash: str, fileext: str, folder: str) -> str:
+    """Move a finished temporary file to where its hash says it lives."""
+    path = os.path.join(folder, hashed_name(filehash, fileext))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        # we already have this image
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
+    return path
+
+
+def sniff(stream) -> str | None:
+    """Work out an image's format from its first bytes, not its name."""
+    start = stream.read(16)
+    stream.seek(0)
+    if start[:4] == b"RIFF" and start[8:12] == b"WEBP":
+        return "webp"
+    for signature, fileext in SIGNATURES:
+        if start.startswith(signature):
+            return fileext
+    return None
+
+
+def store(file, fileext: str) -> str:
+    """Save an uploaded file by its hash, returning the hash."""
+    folder = current_app.config["UPLOAD_FOLDER"]
+    if isinstance(file.stream, HashingFile):
+        # it was already written to disk and hashed while it was uploaded
+        upload = file.stream
+        upload.file.close()
+        filehash = upload.digest.hexdigest()
+        place(upload.path, filehash, fileext, folder)
+        return filehash
+    os.makedirs(os.path.join(folder, "tmp"), exist_ok=True)
+    tmp = os.path.join(folder, "tmp", uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    with open(tmp, "wb") as f:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+            f.write(chunk)
+    filehash = digest.hexdigest()
+    place(tmp, filehash, fileext, folder)
+    return filehash
+
+
+def references(conn, filehash: str, fileext: str | None = None) -> int:
+    if fileext is None:
+        return conn.execute(
+            "SELECT count(*) FROM comics WHERE filehash = ?", (filehash,)
+        ).fetchone()[0]
+    return conn.execute(
+        "SELECT count(*) FROM comics WHERE filehash = ? AND fileext = ?",
+        (filehash, fileext),
+    ).fetchone()[0]
+
+
+def _paths(comic, folder: str | None = None) -> list[str]:
+    paths = [image_path(comic, folder=folder)]
+    for rendition in (comic["renditions"] or "").split(","):
+        if rendition:
+            paths.append(image_path(comic, rendition, folder))
+    return paths
+
+
+def _unused(conn, comic, folder: str | None = None) -> list[str]:
+    """The files of a deleted comic that no other comic uses."""
+    if comic["filehash"] is None or not references(conn, comic["filehash"]):
+        return _paths(comic, folder)
+    # renditions are named by the hash alone, but the original has its
+    # extension too, and older comics may have used another name for it
+    if not references(conn, comic["filehash"], comic["fileext"]):
+        return [image_path(comic, folder=folder)]
+    return []
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def release(conn, comic):
+    """Delete a comic's files, once its row is gone and nothing else uses them.
+
+    Call this after the DELETE has been committed.
+    """
+    with lock:
+        for path in _unused(conn, comic):
+            _remove(path)
+
+
+def release_many(conn, comics, pool, folder: str | None = None):
+    """Like release, for a batch of deleted comics, removing files on `pool`."""
+    with lock:
+        paths = set()
+        for comic in comics:
+            paths.update(_unused(conn, comic, folder))
+        # wait for them all, so nothing can reuse an image before it's gone
+        list(pool.map(_remove, paths))
@@ -0,0 +1,61 @@
+import os
+import zlib
+
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from common.cache import PerDatabase, TaggedCache
+
+# listing pages show up to 50 comics, each one a sticky. Those cards only
+# change when their comic does, so each is rendered once and kept, tagged
+# "comic:<id>" like the pages in common/pagecache.py, whose purges throw
+# them away too. Cards look the same to everyone, so unlike whole pages
+# they're used for logged in artists as well. The admin tools change
+# images and names behind the site's back, so like common/lookups.py they
+# are only kept for CARD_CACHE_TTL seconds
+card_caches = PerDatabase(
+    lambda config: TaggedCache(
+        maxsize=config.get("CARD_CACHE_SIZE", 5000),
+        ttl=config.get("CARD_CACHE_TTL", 300),
+    )
+)
+
+COLOURS = ("s1", "s2", "s3", "s4")
+
+
+def init_app(app):
+    card_caches.get(app.config)
+    if app.config["JINJA_BYTECODE_CACHE"]:
+        # compiled templates, so a new process doesn't have to compile them again
+        folder = os.path.join(app.config["CACHE_FOLDER"], "jinja")
+        os.makedirs(folder, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(folder)
+    app.jinja_env.filters["sticky_colour"] = sticky_colour
+    app.jinja_env.globals["comic_card"] = comic_card
+
+
+def sticky_colour(key) -> str:
+    """The same colour every time for the same comic id or title."""
+    if not isinstance(key, int):
+        key = zlib.crc32(str(key).encode())
+    return COLOURS[key % len(COLOURS)]
+
+
+def comic_card(kind: str, comic, artists: dict | None, series: dict | None) -> Markup:
+    """A comic's sticky for the index ("index"), an artist or a series page."""
+    card_cache = card_caches.get()
+    key = (kind, comic["id"])
+    card = card_cache.get(key)
+    if card is not None:
+        return card
+    generation = card_cache.generation
+    card = Markup(
+        current_app.jinja_env.get_template("card.jinja").render(
+            kind=kind, comic=comic, artists=artists, series=series
+        )
+    )
+    # a purge while we were rendering means this may already be stale
+    if card_cache.maxsize and card_cache.generation == generation:
+        card_cache.set(key, card, (f"comic:{comic['id']}",))
+    return card
@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import subprocess
+
+# the version and commit shown at the bottom of every page. They're worked
+# out once, not on every render: from build_info.json if it exists (the
+# dockerfile writes it, since images don't have the git history), or else
+# by asking git when the app starts
+BUILD_INFO = "build_info.json"
+UNKNOWN = "unknown"
+
+
+def _git(root: str, *args: str) -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", *args], cwd=root, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def from_git(root: str) -> dict[str, str]:
+    return {
+        "COMMIT_ID": _git(root, "rev-parse", "--short", "HEAD") or UNKNOWN,
+        "VERSION": _git(root, "describe", "--tags", "--abbrev=0") or UNKNOWN,
+    }
+
+
+def load(root: str) -> dict[str, str]:
+    try:
+        with open(os.path.join(root, BUILD_INFO)) as f:
+            info = json.load(f)
+        return {"COMMIT_ID": info["COMMIT_ID"], "VERSION": info["VERSION"]}
+    except (OSError, ValueError, KeyError):
+        return from_git(root)
+
+
+def init_app(app):
+    app.jinja_env.globals.update(load(app.root_path))
+
+
+if __name__ == "__main__":
+    # python -m common.version [--commit ID] [--version VERSION]
+    parser = argparse.ArgumentParser(description=f"Write {BUILD_INFO}")
+    parser.add_argument("--commit", help="instead of asking git")
+    parser.add_argument("--version", help="instead of asking git")
+    args = parser.parse_args()
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    info = from_git(root)
+    if args.commit:
+        info["COMMIT_ID"] = args.commit
+    if args.version:
+        info["VERSION"] = args.version
+    with open(os.path.join(root, BUILD_INFO), "w") as f:
+        json.dump(info, f)
+    print(f"version {info['VERSION']}, commit {info['COMMIT_ID']}")
@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+
+import requests
+
+from common.db import database_path, get_db_connection
+
+# discord notifications are written to the outbox table in the same
+# transaction as the comic they announce, and a background thread posts
+# them later. That way a slow or broken webhook never holds up an upload,
+# and a crash or restart doesn't lose the notification
+DISCORD_MAX_EMBEDS = 10
+# how long a sender may hold a batch before another process can retry it
+LEASE = 60
+
+# one dispatcher for each database's outbox, woken up by notify()
+_lock = threading.Lock()
+_wakeups: dict[str, threading.Event] = {}
+
+
+def init_app(app):
+    if app.config["DISCORD_WEBHOOK_URL"] is None:
+        return
+    database = database_path(app.config)
+    with _lock:
+        if database in _wakeups:
+            return
+        _wakeups[database] = wakeup = threading.Event()
+    threading.Thread(
+        target=_dispatch_forever,
+        args=(dict(app.config), wakeup),
+        name="webhooks",
+        daemon=True,
+    ).start()
+
+
+def enqueue(conn, config, username: str, embed: dict):
+    """Add a notification to the outbox, to be committed with the caller's changes.
+
+    Call notify() once the transaction has been committed.
+    """
+    if config["DISCORD_WEBHOOK_URL"] is None:
+        return
+    conn.execute(
+        "INSERT INTO outbox (username, embed, next_attempt) VALUES (?, ?, ?)",
+        (username, json.dumps(embed), time.time()),
+    )
+
+
+def notify():
+    wakeup = _wakeups.get(database_path())
+    if wakeup is not None:
+        wakeup.set()
+
+
+def _backoff(config, attempts: int) -> float:
+    return min(
+        config["WEBHOOK_BACKOFF"] * 2 ** (attempts - 1), config["WEBHOOK_MAX_BACKOFF"]
+    )
+
+
+def _claim(conn) -> tuple[str | None, list]:
+    """Lease the next batch of due notifications that share a username."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    first = conn.execute(
+        "SELECT username FROM outbox WHERE next_attempt <= ? ORDER BY id LIMIT 1",
+        (now,),
+    ).fetchone()
+    if first is None:
+        conn.commit()
+        return None, []
+    # discord shows one username per message, so only same-artist bursts batch
+    rows = conn.execute(
+        "SELECT id, embed, attempts FROM outbox"
+        " WHERE next_attempt <= ? AND username = ? ORDER BY id LIMIT ?",
+        (now, first["username"], DISCORD_MAX_EMBEDS),
+    ).fetchall()
+    conn.executemany(
+        "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+        [(now + LEASE, row["id"]) for row in rows],
+    )
+    conn.commit()
+    return first["username"], rows
+
+
+def _send(config, username: str, rows: list) -> tuple[bool, float | None, str]:
+    """Post a batch, returning (delivered, seconds to wait if told, error)."""
+    try:
+        response = requests.post(
+            config["DISCORD_WEBHOOK_URL"],
+            json={
+                "username": username,
+                "embeds": [json.loads(row["embed"]) for row in rows],
+            },
+            timeout=config["WEBHOOK_TIMEOUT"],
+        )
+    except requests.RequestException as e:
+        return False, None, repr(e)
+    if response.ok:
+        return True, None, ""
+    retry_after = None
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            pass
+    return False, retry_after, f"HTTP {response.status_code}"
+
+
+def _dispatch_once(config) -> bool:
+    """Send one batch from the outbox, returning whether there was one."""
+    conn = get_db_connection(config)
+    username, rows = _claim(conn)
+    if rows:
+        delivered, retry_after, error = _send(config, username, rows)
+        if delivered:
+            conn.executemany(
+                "DELETE FROM outbox WHERE id = ?", [(row["id"],) for row in rows]
+            )
+        else:
+            for row in rows:
+                attempts = row["attempts"] + 1
+                if attempts >= config["WEBHOOK_MAX_ATTEMPTS"]:
+                    print(f"giving up on webhook {row['id']}: {error}")
+                    conn.execute("DELETE FROM outbox WHERE id = ?", (row["id"],))
+                    continue
+                wait = retry_after or _backoff(config, attempts)
+                conn.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ?"
+                    " WHERE id = ?",
+                    (attempts, time.time() + wait, error, row["id"]),
+                )
+        conn.commit()
+    return bool(rows)
+
+
+def _next_due(config) -> float | None:
+    conn = get_db_connection(config)
+    row = conn.execute("SELECT min(next_attempt) FROM outbox").fetchone()
+    conn.close()
+    return row[0]
+
+
+def _dispatch_forever(config, wakeup: threading.Event):
+    while True:
+        try:
+            if not _dispatch_once(config):
+                due = _next_due(config)
+                wait = config["WEBHOOK_POLL_INTERVAL"]
+                if due is not None:
+                    wait = max(0, min(wait, due - time.time()))
+                if wakeup.wait(wait):
+                    wakeup.clear()
+                    # give the rest of a burst of uploads a moment to land,
+                    # so they go out as one message
+                    time.sleep(config["WEBHOOK_BATCH_DELAY"])
+        except Exception as e:
+            print(f"webhook dispatcher failed: {e!r}")
+            get_db_connection(config).close()
+            time.sleep(config["WEBHOOK_POLL_INTERVAL"])
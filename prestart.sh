@@ -0,0 +1,4 @@
+#! /usr/bin/env sh
+# run by the docker image before the site starts, the site won't start on an
+# out of date database
+cd /app && python upgrade_db.py
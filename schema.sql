@@ -2,8 +2,13 @@ DROP TABLE IF EXISTS comics;
 DROP TABLE IF EXISTS artists;
 DROP TABLE IF EXISTS codes;
 DROP TABLE IF EXISTS series;
+DROP TABLE IF EXISTS outbox;
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS comics_search;
+DROP TABLE IF EXISTS series_search;
+DROP TABLE IF EXISTS artists_search;
 
-PRAGMA user_version = 3;
+PRAGMA user_version = 10;
 
 CREATE TABLE artists (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -29,14 +34,113 @@ CREATE TABLE comics (
     fileext TEXT NOT NULL,
     artistid INTEGER NOT NULL,
     seriesid INTEGER,
+    width INTEGER,
+    renditions TEXT,
+    filehash TEXT,
     FOREIGN KEY (artistid)
         REFERENCES artists(id),
     FOREIGN KEY (seriesid)
         REFERENCES series(id)
 );
 
+CREATE INDEX comics_created ON comics (created, id);
+CREATE INDEX comics_artist_created ON comics (artistid, created);
+CREATE INDEX comics_series_created ON comics (seriesid, created);
+CREATE INDEX comics_filehash ON comics (filehash);
+
 CREATE TABLE codes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     code TEXT NOT NULL,
     expired BOOLEAN NOT NULL
 );
+
+CREATE TABLE outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    username TEXT NOT NULL,
+    embed TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT
+);
+
+CREATE INDEX outbox_next_attempt ON outbox (next_attempt);
+
+-- admin jobs run in the background, see common/jobs.py
+CREATE TABLE jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL
+);
+
+CREATE INDEX jobs_status ON jobs (status);
+
+-- full text search, see common/search.py
+CREATE VIRTUAL TABLE comics_search USING fts5 (
+    title, series, artist,
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+-- a title match counts for more than a series or artist match
+INSERT INTO comics_search (comics_search, rank) VALUES ('rank', 'bm25(10.0, 4.0, 2.0)');
+CREATE VIRTUAL TABLE series_search USING fts5 (
+    name, content = 'series', content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+CREATE VIRTUAL TABLE artists_search USING fts5 (
+    username, content = 'artists', content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+
+CREATE TRIGGER comics_search_insert AFTER INSERT ON comics BEGIN
+    INSERT INTO comics_search (rowid, title, series, artist) VALUES (
+        new.id,
+        new.title,
+        (SELECT name FROM series WHERE id = new.seriesid),
+        (SELECT username FROM artists WHERE id = new.artistid)
+    );
+END;
+CREATE TRIGGER comics_search_update AFTER UPDATE OF title, seriesid, artistid ON comics BEGIN
+    UPDATE comics_search SET
+        title = new.title,
+        series = (SELECT name FROM series WHERE id = new.seriesid),
+        artist = (SELECT username FROM artists WHERE id = new.artistid)
+    WHERE rowid = new.id;
+END;
+CREATE TRIGGER comics_search_delete AFTER DELETE ON comics BEGIN
+    DELETE FROM comics_search WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER series_search_insert AFTER INSERT ON series BEGIN
+    INSERT INTO series_search (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER series_search_update AFTER UPDATE OF name ON series BEGIN
+    INSERT INTO series_search (series_search, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO series_search (rowid, name) VALUES (new.id, new.name);
+    UPDATE comics_search SET series = new.name
+    WHERE rowid IN (SELECT id FROM comics WHERE seriesid = new.id);
+END;
+CREATE TRIGGER series_search_delete AFTER DELETE ON series BEGIN
+    INSERT INTO series_search (series_search, rowid, name) VALUES ('delete', old.id, old.name);
+    UPDATE comics_search SET series = NULL
+    WHERE rowid IN (SELECT id FROM comics WHERE seriesid = old.id);
+END;
+
+CREATE TRIGGER artists_search_insert AFTER INSERT ON artists BEGIN
+    INSERT INTO artists_search (rowid, username) VALUES (new.id, new.username);
+END;
+CREATE TRIGGER artists_search_update AFTER UPDATE OF username ON artists BEGIN
+    INSERT INTO artists_search (artists_search, rowid, username) VALUES ('delete', old.id, old.username);
+    INSERT INTO artists_search (rowid, username) VALUES (new.id, new.username);
+    UPDATE comics_search SET artist = new.username
+    WHERE rowid IN (SELECT id FROM comics WHERE artistid = new.id);
+END;
+CREATE TRIGGER artists_search_delete AFTER DELETE ON artists BEGIN
+    INSERT INTO artists_search (artists_search, rowid, username) VALUES ('delete', old.id, old.username);
+END;
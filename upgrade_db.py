@@ -1,8 +1,13 @@
 import sqlite3
+import os
+import sys
 
+# bump this with every new version below, the site won't start on an older database
+LATEST = 10
 
-def upgrade_if_needed():
-    connection = sqlite3.connect('db/database.db')
+
+def upgrade_if_needed(path: str = 'db/database.db'):
+    connection = sqlite3.connect(path)
     version: int = connection.execute("SELECT * FROM pragma_user_version").fetchone()[0]
     if version < 1:
         # v0 to v1
@@ -19,8 +24,126 @@ def upgrade_if_needed():
         print(f"Upgrading from v{version} to v3!")
         connection.execute("ALTER TABLE artists ADD COLUMN islocked BOOLEAN NOT NULL DEFAULT 0")
         connection.execute("PRAGMA user_version = 3")
+    if version < 4:
+        print(f"Upgrading from v{version} to v4!")
+        # indexes for cursor pagination, newest first
+        connection.execute("CREATE INDEX IF NOT EXISTS comics_created ON comics (created, id)")
+        connection.execute("CREATE INDEX IF NOT EXISTS comics_artist_created ON comics (artistid, created)")
+        connection.execute("CREATE INDEX IF NOT EXISTS comics_series_created ON comics (seriesid, created)")
+        connection.execute("PRAGMA user_version = 4")
+    if version < 5:
+        print(f"Upgrading from v{version} to v5!")
+        # the original's width, and which downscaled copies of it exist
+        connection.execute("ALTER TABLE comics ADD COLUMN width INTEGER")
+        connection.execute("ALTER TABLE comics ADD COLUMN renditions TEXT")
+        connection.execute("PRAGMA user_version = 5")
+    if version < 6:
+        print(f"Upgrading from v{version} to v6!")
+        # images are named by the sha256 of their contents, see common/storage.py
+        # admin_tools/migrate_storage.py moves the existing files over
+        connection.execute("ALTER TABLE comics ADD COLUMN filehash TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS comics_filehash ON comics (filehash)")
+        connection.execute("PRAGMA user_version = 6")
+    if version < 7:
+        print(f"Upgrading from v{version} to v7!")
+        # discord notifications waiting to be sent, see common/webhooks.py
+        connection.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, username TEXT NOT NULL, embed TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, last_error TEXT)")
+        connection.execute("CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox (next_attempt)")
+        connection.execute("PRAGMA user_version = 7")
+    if version < 8:
+        print(f"Upgrading from v{version} to v8!")
+        # full text search, see common/search.py. The triggers keep it in sync
+        connection.executescript("""
+            BEGIN;
+            CREATE VIRTUAL TABLE comics_search USING fts5 (
+                title, series, artist,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            );
+            -- a title match counts for more than a series or artist match
+            INSERT INTO comics_search (comics_search, rank) VALUES ('rank', 'bm25(10.0, 4.0, 2.0)');
+            CREATE VIRTUAL TABLE series_search USING fts5 (
+                name, content = 'series', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            );
+            CREATE VIRTUAL TABLE artists_search USING fts5 (
+                username, content = 'artists', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            );
+
+            CREATE TRIGGER comics_search_insert AFTER INSERT ON comics BEGIN
+                INSERT INTO comics_search (rowid, title, series, artist) VALUES (
+                    new.id,
+                    new.title,
+                    (SELECT name FROM series WHERE id = new.seriesid),
+                    (SELECT username FROM artists WHERE id = new.artistid)
+                );
+            END;
+            CREATE TRIGGER comics_search_update AFTER UPDATE OF title, seriesid, artistid ON comics BEGIN
+                UPDATE comics_search SET
+                    title = new.title,
+                    series = (SELECT name FROM series WHERE id = new.seriesid),
+                    artist = (SELECT username FROM artists WHERE id = new.artistid)
+                WHERE rowid = new.id;
+            END;
+            CREATE TRIGGER comics_search_delete AFTER DELETE ON comics BEGIN
+                DELETE FROM comics_search WHERE rowid = old.id;
+            END;
+
+            CREATE TRIGGER series_search_insert AFTER INSERT ON series BEGIN
+                INSERT INTO series_search (rowid, name) VALUES (new.id, new.name);
+            END;
+            CREATE TRIGGER series_search_update AFTER UPDATE OF name ON series BEGIN
+                INSERT INTO series_search (series_search, rowid, name) VALUES ('delete', old.id, old.name);
+                INSERT INTO series_search (rowid, name) VALUES (new.id, new.name);
+                UPDATE comics_search SET series = new.name
+                WHERE rowid IN (SELECT id FROM comics WHERE seriesid = new.id);
+            END;
+            CREATE TRIGGER series_search_delete AFTER DELETE ON series BEGIN
+                INSERT INTO series_search (series_search, rowid, name) VALUES ('delete', old.id, old.name);
+                UPDATE comics_search SET series = NULL
+                WHERE rowid IN (SELECT id FROM comics WHERE seriesid = old.id);
+            END;
+
+            CREATE TRIGGER artists_search_insert AFTER INSERT ON artists BEGIN
+                INSERT INTO artists_search (rowid, username) VALUES (new.id, new.username);
+            END;
+            CREATE TRIGGER artists_search_update AFTER UPDATE OF username ON artists BEGIN
+                INSERT INTO artists_search (artists_search, rowid, username) VALUES ('delete', old.id, old.username);
+                INSERT INTO artists_search (rowid, username) VALUES (new.id, new.username);
+                UPDATE comics_search SET artist = new.username
+                WHERE rowid IN (SELECT id FROM comics WHERE artistid = new.id);
+            END;
+            CREATE TRIGGER artists_search_delete AFTER DELETE ON artists BEGIN
+                INSERT INTO artists_search (artists_search, rowid, username) VALUES ('delete', old.id, old.username);
+            END;
+            INSERT INTO comics_search (rowid, title, series, artist)
+            SELECT c.id, c.title, s.name, a.username FROM comics c
+            LEFT JOIN series s ON s.id = c.seriesid
+            LEFT JOIN artists a ON a.id = c.artistid;
+            INSERT INTO series_search (series_search) VALUES ('rebuild');
+            INSERT INTO artists_search (artists_search) VALUES ('rebuild');
+            PRAGMA user_version = 8;
+            COMMIT;
+        """)
+    if version < 9:
+        print(f"Upgrading from v{version} to v9!")
+        # admin jobs run in the background, see common/jobs.py
+        connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, kind TEXT NOT NULL, args TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', done INTEGER NOT NULL DEFAULT 0, total INTEGER, error TEXT, updated REAL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        connection.execute("PRAGMA user_version = 9")
+    if version < 10:
+        print(f"Upgrading from v{version} to v10!")
+        # how far through the comics a job has got, by id
+        connection.execute("ALTER TABLE jobs ADD COLUMN last_id INTEGER NOT NULL DEFAULT 0")
+        connection.execute("PRAGMA user_version = 10")
     connection.commit()
     connection.close()
 
 if __name__ == "__main__":
-    upgrade_if_needed()
\ No newline at end of file
+    # python upgrade_db.py [path], or the DATABASE from the environment
+    if len(sys.argv) > 1:
+        upgrade_if_needed(sys.argv[1])
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        upgrade_if_needed(os.getenv("DATABASE", "db/database.db"))
\ No newline at end of file